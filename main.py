@@ -1,7 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from src.api.routes import router as theme_router
+from src.core.admission import AdmissionMiddleware, admission_controller
 from src.core.config import settings
+from src.services.llm_router import get_llm_router
 from loguru import logger
 
 # Configurar logging
@@ -14,6 +17,15 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Controle de admissão das análises (custo estimado por cliente e global).
+# Registrado antes do CORS para que as recusas também levem os headers CORS
+if settings.admission_enabled:
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission_controller,
+        path=f"{settings.api_prefix}/themes/analyze"
+    )
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +53,15 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas de admissão e dos provedores de LLM no formato texto do Prometheus"""
+    return PlainTextResponse(
+        admission_controller.metrics.render(admission_controller) + get_llm_router().render_metrics(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Adicionar o diretório pai ao path para imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+from sqlalchemy import delete, select, update
+from src.core.cache import catalog_cache
+from src.core.config import settings
+from src.core.database import engine
+from src.models.database import Theme
+from src.utils.semantic import embedding_buckets
+from loguru import logger
+
+
+async def list_tenants() -> List[str]:
+    """Tenants com temas no catálogo"""
+    async with engine.connect() as conn:
+        rows = (await conn.execute(select(Theme.tenant_id).distinct().order_by(Theme.tenant_id))).all()
+    return [row.tenant_id for row in rows]
+
+
+async def bucket_catalog(tenant_id: str, bits: int, seed: int, chunk_size: int):
+    """Lê os embeddings em streaming e guarda só (id, bucket) de cada tema.
+
+    A memória usada é de 16 bytes por tema mais um chunk de embeddings, o que
+    permite percorrer catálogos com milhões de linhas. O filtro por tenant
+    restringe a leitura à partição dele.
+    """
+    ids, buckets = [], []
+    async with engine.connect() as conn:
+        result = await conn.stream(
+            select(Theme.id, Theme.embedding)
+            .where(Theme.tenant_id == tenant_id, Theme.embedding.isnot(None))
+            .order_by(Theme.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async for rows in result.partitions(chunk_size):
+            ids.append(np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows)))
+            buckets.append(embedding_buckets([row.embedding for row in rows], bits, seed))
+
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(ids), np.concatenate(buckets)
+
+
+async def load_embeddings(tenant_id: str, ids: np.ndarray):
+    """Carrega os embeddings normalizados dos temas de um bucket que ainda existem"""
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(Theme.id, Theme.embedding)
+            .where(Theme.tenant_id == tenant_id, Theme.id.in_(ids.tolist()))
+            .order_by(Theme.id)
+        )).all()
+    present = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+    vectors = np.asarray([row.embedding for row in rows], dtype=np.float32).reshape(len(rows), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return present, vectors / np.where(norms == 0, 1, norms)
+
+
+def find_clusters(ids: np.ndarray, vectors: np.ndarray, threshold: float) -> List[List[int]]:
+    """Agrupa temas ligados por similaridade de cosseno acima do limiar (union-find).
+
+    Os grupos são só candidatos: encadeamentos A~B~C~D juntam temas distantes
+    entre si, e ``merge_cluster`` confere cada membro contra o tema mantido.
+    """
+    similarity = vectors @ vectors.T
+    left, right = np.nonzero(np.triu(similarity > threshold, k=1))
+
+    parent = np.arange(len(ids))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(left.tolist(), right.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters: Dict[int, List[int]] = {}
+    for index in range(len(ids)):
+        clusters.setdefault(find(index), []).append(int(ids[index]))
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def merge_keywords(rows) -> List[str]:
+    """União das palavras-chave, preservando a ordem e ignorando maiúsculas"""
+    merged, seen = [], set()
+    for row in rows:
+        keywords = json.loads(row.palavras_chave) if isinstance(row.palavras_chave, str) else row.palavras_chave
+        for keyword in keywords or []:
+            if keyword.casefold() not in seen:
+                seen.add(keyword.casefold())
+                merged.append(keyword)
+    return merged
+
+
+def cosine_similarity(left, right) -> float:
+    left = np.asarray(left, dtype=np.float32)
+    right = np.asarray(right, dtype=np.float32)
+    norm = np.linalg.norm(left) * np.linalg.norm(right)
+    return float(left @ right / norm) if norm > 0 else 0.0
+
+
+async def merge_cluster(tenant_id: str, cluster: List[int], threshold: float, dry_run: bool) -> Optional[dict]:
+    """Funde um cluster no tema mais recorrente, em uma transação própria.
+
+    Só são fundidos os membros com similaridade acima do limiar em relação ao
+    tema mantido; os demais ficam intactos para as próximas passadas.
+    """
+    async with engine.begin() as conn:
+        query = (
+            select(
+                Theme.id, Theme.tema_geral, Theme.subtema, Theme.palavras_chave,
+                Theme.relevancia, Theme.occurrence_count, Theme.embedding
+            )
+            .where(Theme.tenant_id == tenant_id, Theme.id.in_(cluster))
+            .order_by(Theme.id)
+        )
+        if not dry_run:
+            query = query.with_for_update()
+        rows = (await conn.execute(query)).all()
+
+        # Temas podem ter sido apagados desde a leitura dos buckets
+        if len(rows) < 2:
+            return None
+
+        keep = max(rows, key=lambda row: (row.occurrence_count or 0, -row.id))
+        dropped = [
+            row for row in rows
+            if row.id != keep.id and cosine_similarity(keep.embedding, row.embedding) > threshold
+        ]
+        if not dropped:
+            return None
+        rows = [keep] + dropped
+        report = {
+            "tenant_id": tenant_id,
+            "keep_id": keep.id,
+            "tema_geral": keep.tema_geral,
+            "subtema": keep.subtema,
+            "merged": [
+                {"id": row.id, "tema_geral": row.tema_geral, "subtema": row.subtema}
+                for row in dropped
+            ],
+            "relevancia": sum(row.relevancia or 0 for row in rows),
+            "occurrence_count": sum(row.occurrence_count or 0 for row in rows),
+            "palavras_chave": merge_keywords([keep] + dropped),
+        }
+
+        if dry_run:
+            return report
+
+        # Nenhuma outra tabela referencia themes: a fusão é só o update + delete
+        await conn.execute(
+            update(Theme)
+            .where(Theme.tenant_id == tenant_id, Theme.id == keep.id)
+            .values(
+                relevancia=report["relevancia"],
+                occurrence_count=report["occurrence_count"],
+                palavras_chave=json.dumps(report["palavras_chave"], ensure_ascii=False)
+            )
+        )
+        await conn.execute(
+            delete(Theme)
+            .where(Theme.tenant_id == tenant_id, Theme.id.in_([row.id for row in dropped]))
+        )
+        return report
+
+
+async def compact_themes(
+    threshold: float,
+    bits: int,
+    passes: int,
+    chunk_size: int,
+    max_bucket_size: int,
+    dry_run: bool,
+    report_path: Optional[str] = None,
+    tenants: Optional[List[str]] = None
+):
+    """Funde temas quase duplicados do catálogo.
+
+    Cada tenant é compactado separadamente: temas de tenants diferentes nunca
+    são fundidos. Cada passada distribui os temas em buckets LSH (hiperplanos
+    aleatórios) e compara, de forma vetorizada, apenas temas do mesmo bucket.
+    Passadas com sementes diferentes recuperam pares que caíram em buckets
+    vizinhos.
+    """
+    report_file = open(report_path, "w", encoding="utf-8") if report_path else None
+    total_clusters = 0
+    total_removed = 0
+
+    try:
+        for tenant_id in tenants or await list_tenants():
+            clusters, removed = await compact_tenant(
+                tenant_id, threshold, bits, passes, chunk_size, max_bucket_size, dry_run, report_file
+            )
+            total_clusters += clusters
+            total_removed += removed
+    finally:
+        if report_file:
+            report_file.close()
+
+    action = "seriam removidos" if dry_run else "removidos"
+    logger.info(f"Compactação concluída: {total_clusters} clusters, {total_removed} temas {action}")
+
+
+async def compact_tenant(
+    tenant_id: str,
+    threshold: float,
+    bits: int,
+    passes: int,
+    chunk_size: int,
+    max_bucket_size: int,
+    dry_run: bool,
+    report_file=None
+):
+    """Compacta o catálogo de um tenant; retorna (clusters, temas removidos)"""
+    total_clusters = 0
+    total_removed = 0
+
+    for seed in range(passes):
+        ids, buckets = await bucket_catalog(tenant_id, bits, seed, chunk_size)
+        logger.info(
+            f"Tenant {tenant_id}, passada {seed + 1}/{passes}: "
+            f"{len(ids)} temas em {len(np.unique(buckets))} buckets"
+        )
+
+        order = np.argsort(buckets, kind="stable")
+        ids, buckets = ids[order], buckets[order]
+        boundaries = np.flatnonzero(np.diff(buckets)) + 1
+
+        for group in np.split(ids, boundaries):
+            # Buckets muito grandes são comparados em janelas para limitar memória
+            for start in range(0, len(group), max_bucket_size):
+                window = group[start:start + max_bucket_size]
+                if len(window) < 2:
+                    continue
+
+                window, vectors = await load_embeddings(tenant_id, window)
+                for cluster in find_clusters(window, vectors, threshold):
+                    report = await merge_cluster(tenant_id, cluster, threshold, dry_run)
+                    if report is None:
+                        continue
+                    if not dry_run:
+                        catalog_cache.bump_version(tenant_id)
+
+                    total_clusters += 1
+                    total_removed += len(report["merged"])
+                    logger.info(
+                        f"{'[dry-run] ' if dry_run else ''}Tenant {tenant_id}: tema {report['keep_id']} "
+                        f"({report['tema_geral']}) absorve {[item['id'] for item in report['merged']]}"
+                    )
+                    if report_file:
+                        report_file.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+        if dry_run:
+            # Sem escrita, as passadas seguintes reportariam os mesmos clusters
+            break
+
+    return total_clusters, total_removed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compacta temas quase duplicados do catálogo")
+    parser.add_argument("--threshold", type=float, default=settings.similarity_threshold,
+                        help="Similaridade mínima para fundir temas")
+    parser.add_argument("--bits", type=int, default=8,
+                        help="Bits do bucket LSH (mais bits, buckets menores)")
+    parser.add_argument("--passes", type=int, default=3,
+                        help="Passadas com sementes LSH diferentes")
+    parser.add_argument("--chunk-size", type=int, default=5000,
+                        help="Linhas lidas por vez do banco")
+    parser.add_argument("--max-bucket-size", type=int, default=2000,
+                        help="Máximo de temas comparados por vez dentro de um bucket")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Apenas reporta os clusters, sem alterar o banco")
+    parser.add_argument("--report", help="Arquivo JSONL com o relatório dos clusters")
+    parser.add_argument("--tenant", action="append", dest="tenants",
+                        help="Tenant a compactar (repetível; padrão: todos)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(compact_themes(
+        threshold=args.threshold,
+        bits=args.bits,
+        passes=args.passes,
+        chunk_size=args.chunk_size,
+        max_bucket_size=args.max_bucket_size,
+        dry_run=args.dry_run,
+        report_path=args.report,
+        tenants=args.tenants
+    ))
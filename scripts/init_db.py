@@ -1,17 +1,151 @@
+import argparse
 import asyncio
+import re
 import sys
 from pathlib import Path
+from typing import Iterable, List
 
 # Adicionar o diretório pai ao path para imports
 sys.path.append(str(Path(__file__).parent.parent))
 
 from sqlalchemy import text
+from src.core.config import settings
 from src.core.database import engine
-from src.models.database import Base
+from src.models.database import Base, tenant_partition_name
+from src.models.schemas import TENANT_ID_PATTERN
+from src.utils.semantic import normalize_theme_key
 from loguru import logger
 
 
-async def init_database():
+# Partição DEFAULT: recebe tenants que ainda não têm partição própria
+SHARED_PARTITION = "themes_shared"
+LEGACY_TABLE = "themes_legacy"
+
+
+async def rename_legacy_table(conn) -> bool:
+    """Renomeia a tabela themes não particionada de versões anteriores.
+
+    Retorna True se havia uma tabela legada, cujas linhas são copiadas para a
+    tabela particionada por ``migrate_legacy_rows``.
+    """
+    relkind = (await conn.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = 'themes' AND relnamespace = 'public'::regnamespace")
+    )).scalar()
+    if relkind != "r":
+        return False
+
+    logger.info("Tabela themes não particionada encontrada, migrando para partições por tenant")
+    await conn.execute(text("ALTER TABLE themes ADD COLUMN IF NOT EXISTS semantic_key VARCHAR(512)"))
+    await conn.execute(text(f"ALTER TABLE themes RENAME TO {LEGACY_TABLE}"))
+
+    # Índices, constraints e sequência mantêm o nome antigo e colidiriam com os novos
+    await conn.execute(text(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT themes_pkey TO {LEGACY_TABLE}_pkey"))
+    await conn.execute(text(f"ALTER SEQUENCE IF EXISTS themes_id_seq RENAME TO {LEGACY_TABLE}_id_seq"))
+    index_names = (await conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname LIKE 'ix_themes_%'"),
+        {"table": LEGACY_TABLE}
+    )).scalars().all()
+    for name in index_names:
+        await conn.execute(text(f"ALTER INDEX {name} RENAME TO {name.replace('ix_themes_', f'ix_{LEGACY_TABLE}_', 1)}"))
+    return True
+
+
+async def ensure_partition(conn, partition: str, tenant_id: str = None):
+    """Cria a partição (e, se for de um tenant, seu índice HNSW) se ainda não existir.
+
+    A partição de um tenant novo é criada fora da tabela, recebe as linhas do
+    tenant que estavam na partição DEFAULT e só então é anexada: anexar com
+    essas linhas ainda na DEFAULT falharia.
+    """
+    exists = (await conn.execute(text("SELECT to_regclass(:name)"), {"name": partition})).scalar()
+    if exists is None:
+        if tenant_id is None:
+            await conn.execute(text(f"CREATE TABLE {partition} PARTITION OF themes DEFAULT"))
+        else:
+            await conn.execute(text(f"CREATE TABLE {partition} (LIKE themes INCLUDING DEFAULTS)"))
+            await conn.execute(
+                text(f"WITH moved AS (DELETE FROM {SHARED_PARTITION} WHERE tenant_id = :tenant_id RETURNING *) "
+                     f"INSERT INTO {partition} SELECT * FROM moved"),
+                {"tenant_id": tenant_id}
+            )
+            await conn.execute(text(
+                f"ALTER TABLE themes ATTACH PARTITION {partition} FOR VALUES IN ('{tenant_id}')"
+            ))
+        logger.info(f"Partição {partition} criada")
+
+    index_name = f"ix_{partition}_embedding_hnsw"
+    if tenant_id is None:
+        # A partição DEFAULT mistura tenants e o pgvector filtra depois da busca
+        # no grafo (ef_search candidatos): um tenant pequeno ficaria sem vizinho.
+        # Sem índice, a busca nela é um scan exato.
+        await conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        return
+
+    # Índice vetorial por partição: a busca de um tenant só percorre o grafo dele
+    await conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {index_name} "
+        f"ON {partition} USING hnsw (embedding vector_cosine_ops)"
+    ))
+
+
+async def migrate_legacy_rows(conn):
+    """Copia os temas da tabela legada para o tenant padrão e a remove"""
+    columns = ", ".join(
+        column.name for column in Base.metadata.tables["themes"].columns if column.name != "tenant_id"
+    )
+    result = await conn.execute(
+        text(f"INSERT INTO themes (tenant_id, {columns}) SELECT :tenant_id, {columns} FROM {LEGACY_TABLE}"),
+        {"tenant_id": settings.default_tenant}
+    )
+    await conn.execute(text("SELECT setval('themes_id_seq', GREATEST((SELECT MAX(id) FROM themes), 1))"))
+    await conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+    logger.info(f"{result.rowcount} temas migrados para o tenant {settings.default_tenant}")
+
+
+async def migrate_semantic_keys(conn, batch_size: int = 1000):
+    """Preenche a chave semântica de temas criados antes dela"""
+    last_id = 0
+    while True:
+        rows = (await conn.execute(
+            text("""
+                SELECT id, tenant_id, tema_geral, subtema FROM themes
+                WHERE semantic_key IS NULL AND id > :last_id
+                ORDER BY id LIMIT :limit
+            """),
+            {"last_id": last_id, "limit": batch_size}
+        )).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        
+        # Temas com chave repetida ficam sem chave até serem fundidos pela compactação
+        await conn.execute(
+            text("""
+                UPDATE themes SET semantic_key = :key
+                WHERE id = :id AND tenant_id = :tenant_id
+                  AND NOT EXISTS (
+                      SELECT 1 FROM themes WHERE tenant_id = :tenant_id AND semantic_key = :key
+                  )
+            """),
+            [
+                {"id": row.id, "tenant_id": row.tenant_id, "key": normalize_theme_key(row.tema_geral, row.subtema)}
+                for row in rows
+            ]
+        )
+
+
+def partition_tenants(extra: Iterable[str]) -> List[str]:
+    """Tenants com partição própria: os configurados, o padrão e os da linha de comando"""
+    tenants = []
+    for tenant_id in [settings.default_tenant, *settings.tenants, *extra]:
+        if not re.match(TENANT_ID_PATTERN, tenant_id):
+            raise ValueError(f"tenant_id inválido: {tenant_id!r}")
+        if tenant_id not in tenants:
+            tenants.append(tenant_id)
+    return tenants
+
+
+async def init_database(tenants: Iterable[str] = ()):
     """Inicializa o banco de dados e cria as tabelas"""
     try:
         logger.info("Iniciando criação do banco de dados...")
@@ -21,10 +155,23 @@ async def init_database():
             await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
             logger.info("Extensão pgvector criada/verificada")
             
+            has_legacy = await rename_legacy_table(conn)
+            
             # Criar todas as tabelas
             await conn.run_sync(Base.metadata.create_all)
             logger.info("Tabelas criadas com sucesso")
             
+            await ensure_partition(conn, SHARED_PARTITION)
+            for tenant_id in partition_tenants(tenants):
+                await ensure_partition(conn, tenant_partition_name(tenant_id), tenant_id)
+            logger.info("Partições por tenant verificadas")
+            
+            if has_legacy:
+                await migrate_legacy_rows(conn)
+            
+            await migrate_semantic_keys(conn)
+            logger.info("Chave semântica dos temas verificada")
+            
         logger.info("Banco de dados inicializado com sucesso!")
         
     except Exception as e:
@@ -32,5 +179,13 @@ async def init_database():
         raise
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cria o schema e as partições do catálogo de temas")
+    parser.add_argument("--tenant", action="append", dest="tenants", default=[],
+                        help="Tenant que deve ganhar partição própria (repetível)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    asyncio.run(init_database())
\ No newline at end of file
+    args = parse_args()
+    asyncio.run(init_database(args.tenants))
@@ -1,12 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import Any, Awaitable, Callable, List, Optional
+from src.core.cache import CacheEntry, catalog_cache
+from src.core.config import settings
 from src.core.database import get_db
 from src.services.conversation_processor import ConversationProcessor
+from src.services.theme_export import MEDIA_TYPES, ThemeExporter, parquet_available
 from src.services.theme_repository import ThemeRepository
 from src.models.schemas import (
     ConversationAnalysisRequest,
     ConversationAnalysisResponse,
+    ExportFormat,
+    TENANT_ID_PATTERN,
     ThemeResponse
 )
 from loguru import logger
@@ -14,6 +23,36 @@ from loguru import logger
 router = APIRouter(prefix="/themes", tags=["themes"])
 
 
+def _cached_response(request: Request, entry: CacheEntry) -> Response:
+    """Responde com ETag, ou 304 se o cliente já tem a versão atual"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+async def _read_through(
+    request: Request,
+    tenant_id: str,
+    key: str,
+    build: Callable[[], Awaitable[Any]]
+) -> Response:
+    """Serve a resposta do cache do catálogo ou a gera e guarda na versão atual"""
+    # O SQLite do cache é bloqueante: fora do event loop
+    entry, version = await asyncio.to_thread(catalog_cache.lookup, tenant_id, key)
+    if entry is None:
+        content = jsonable_encoder(await build())
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = await asyncio.to_thread(catalog_cache.set, tenant_id, key, version, body)
+    return _cached_response(request, entry)
+
+
+def get_tenant_id(tenant_id: Optional[str] = Query(None, pattern=TENANT_ID_PATTERN)) -> str:
+    """Tenant da requisição (ou o tenant padrão)"""
+    return tenant_id or settings.default_tenant
+
+
 @router.post("/analyze", response_model=ConversationAnalysisResponse)
 async def analyze_conversations(
     request: ConversationAnalysisRequest,
@@ -24,7 +63,8 @@ async def analyze_conversations(
         processor = ConversationProcessor()
         result = await processor.process_conversations(
             request.conversations,
-            db
+            db,
+            tenant_id=request.tenant_id or settings.default_tenant
         )
         return result
     except Exception as e:
@@ -34,71 +74,112 @@ async def analyze_conversations(
 
 @router.get("/", response_model=List[ThemeResponse])
 async def get_all_themes(
-    limit: int = 100,
+    request: Request,
+    limit: int = Query(100, ge=1, le=settings.theme_list_max_limit),
+    tenant_id: str = Depends(get_tenant_id),
     db: AsyncSession = Depends(get_db)
 ):
     """Retorna todos os temas ordenados por relevância"""
     try:
-        repository = ThemeRepository(db)
-        themes = await repository.get_all_themes(limit=limit)
-        
-        # Converter para schema de resposta
-        response_themes = []
-        for theme in themes:
-            import json
-            palavras_chave = json.loads(theme.palavras_chave) if isinstance(theme.palavras_chave, str) else theme.palavras_chave
-            
-            response_themes.append(ThemeResponse(
-                id=theme.id,
-                tema_geral=theme.tema_geral,
-                subtema=theme.subtema,
-                categoria=theme.categoria,
-                palavras_chave=palavras_chave,
-                relevancia=theme.relevancia,
-                occurrence_count=theme.occurrence_count,
-                created_at=theme.created_at,
-                updated_at=theme.updated_at
-            ))
-        
-        return response_themes
+        return await _read_through(
+            request,
+            tenant_id,
+            f"themes:list:limit={limit}",
+            lambda: _build_theme_list(db, tenant_id, limit)
+        )
     except Exception as e:
         logger.error(f"Erro ao buscar temas: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/stats")
-async def get_theme_statistics(db: AsyncSession = Depends(get_db)):
+async def get_theme_statistics(
+    request: Request,
+    tenant_id: str = Depends(get_tenant_id),
+    db: AsyncSession = Depends(get_db)
+):
     """Retorna estatísticas sobre os temas"""
     try:
-        repository = ThemeRepository(db)
-        themes = await repository.get_all_themes()
-        
-        # Calcular estatísticas
-        total_themes = len(themes)
-        total_occurrences = sum(theme.occurrence_count for theme in themes)
-        avg_relevance = sum(theme.relevancia for theme in themes) / total_themes if total_themes > 0 else 0
-        
-        # Categorias mais comuns
-        category_counts = {}
-        for theme in themes:
-            category = theme.categoria.value if hasattr(theme.categoria, 'value') else theme.categoria
-            category_counts[category] = category_counts.get(category, 0) + 1
-        
-        return {
-            "total_themes": total_themes,
-            "total_occurrences": total_occurrences,
-            "average_relevance": round(avg_relevance, 2),
-            "categories": category_counts,
-            "top_themes": [
-                {
-                    "tema_geral": theme.tema_geral,
-                    "subtema": theme.subtema,
-                    "relevancia": theme.relevancia,
-                    "occurrences": theme.occurrence_count
-                }
-                for theme in themes[:10]  # Top 10 temas
-            ]
-        }
+        return await _read_through(
+            request,
+            tenant_id,
+            "themes:stats",
+            lambda: _build_theme_statistics(db, tenant_id)
+        )
     except Exception as e:
         logger.error(f"Erro ao calcular estatísticas: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/export")
+async def export_themes(
+    format: ExportFormat = ExportFormat.NDJSON,
+    include_embeddings: bool = False,
+    tenant_id: str = Depends(get_tenant_id)
+):
+    """Exporta o catálogo completo em streaming (CSV, NDJSON ou Parquet)"""
+    if format == ExportFormat.PARQUET and not parquet_available():
+        raise HTTPException(status_code=501, detail="Exportação Parquet requer o pacote pyarrow")
+    
+    exporter = ThemeExporter(format, tenant_id, include_embeddings=include_embeddings)
+    return StreamingResponse(
+        exporter.stream(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="themes.{format.value}"'}
+    )
+
+
+async def _build_theme_list(db: AsyncSession, tenant_id: str, limit: int) -> List[ThemeResponse]:
+    repository = ThemeRepository(db, tenant_id)
+    themes = await repository.get_all_themes(limit=limit)
+    
+    # Converter para schema de resposta
+    response_themes = []
+    for theme in themes:
+        palavras_chave = json.loads(theme.palavras_chave) if isinstance(theme.palavras_chave, str) else theme.palavras_chave
+        
+        response_themes.append(ThemeResponse(
+            id=theme.id,
+            tema_geral=theme.tema_geral,
+            subtema=theme.subtema,
+            categoria=theme.categoria,
+            palavras_chave=palavras_chave,
+            relevancia=theme.relevancia,
+            occurrence_count=theme.occurrence_count,
+            created_at=theme.created_at,
+            updated_at=theme.updated_at
+        ))
+    
+    return response_themes
+
+
+async def _build_theme_statistics(db: AsyncSession, tenant_id: str) -> dict:
+    repository = ThemeRepository(db, tenant_id)
+    themes = await repository.get_all_themes()
+    
+    # Calcular estatísticas
+    total_themes = len(themes)
+    total_occurrences = sum(theme.occurrence_count for theme in themes)
+    avg_relevance = sum(theme.relevancia for theme in themes) / total_themes if total_themes > 0 else 0
+    
+    # Categorias mais comuns
+    category_counts = {}
+    for theme in themes:
+        category = theme.categoria.value if hasattr(theme.categoria, 'value') else theme.categoria
+        category_counts[category] = category_counts.get(category, 0) + 1
+    
+    return {
+        "total_themes": total_themes,
+        "total_occurrences": total_occurrences,
+        "average_relevance": round(avg_relevance, 2),
+        "categories": category_counts,
+        "top_themes": [
+            {
+                "tema_geral": theme.tema_geral,
+                "subtema": theme.subtema,
+                "relevancia": theme.relevancia,
+                "occurrences": theme.occurrence_count
+            }
+            for theme in themes[:10]  # Top 10 temas
+        ]
+    }
@@ -0,0 +1,369 @@
+import asyncio
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from src.core.config import settings
+from src.utils.text import estimate_tokens
+from loguru import logger
+
+
+class TokenBucket:
+    """Balde de tokens: ``rate`` tokens por segundo, até ``capacity`` acumulados"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, cost: float) -> float:
+        """Consome ``cost`` tokens; se não houver saldo, retorna os segundos até haver"""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def refund(self, cost: float):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class ClientRateLimiter:
+    """Um balde de tokens por cliente, com os menos recentes descartados (LRU)"""
+
+    def __init__(self, rate: float, capacity: float, max_clients: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def bucket(self, client: str) -> TokenBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.capacity)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class ConcurrencyBudget:
+    """Orçamento global de análises em andamento, em número e em custo.
+
+    Quem não cabe no orçamento espera em uma fila FIFO limitada: um pedido
+    grande à frente não é ultrapassado por pedidos pequenos, o que evita que
+    ele fique esperando indefinidamente.
+    """
+
+    def __init__(self, max_requests: int, max_cost: int, max_waiters: int):
+        self.max_requests = max_requests
+        self.max_cost = max_cost
+        self.max_waiters = max_waiters
+        self.requests = 0
+        self.cost = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, cost: int) -> bool:
+        return self.requests < self.max_requests and self.cost + cost <= self.max_cost
+
+    def _take(self, cost: int):
+        self.requests += 1
+        self.cost += cost
+
+    def clamp(self, cost: int) -> int:
+        # Um pedido maior que o orçamento inteiro ainda pode rodar sozinho
+        return min(cost, self.max_cost)
+
+    async def acquire(self, cost: int, timeout: float) -> bool:
+        """Reserva ``cost`` no orçamento; False se a fila estiver cheia ou o tempo esgotar"""
+        if not self._waiters and self._fits(cost):
+            self._take(cost)
+            return True
+        if len(self._waiters) >= self.max_waiters:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (cost, future)
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if future.done():
+                # Reservado no mesmo instante do timeout
+                return True
+            self._discard(waiter)
+            return False
+        except asyncio.CancelledError:
+            if future.done():
+                self.release(cost)
+            else:
+                self._discard(waiter)
+            raise
+
+    def would_queue(self, cost: int) -> bool:
+        return bool(self._waiters) or not self._fits(cost)
+
+    def _discard(self, waiter: Tuple[int, asyncio.Future]):
+        waiter[1].cancel()
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        # Quem estava atrás de um pedido grande pode caber agora
+        self._wake()
+
+    def release(self, cost: int):
+        self.requests -= 1
+        self.cost -= cost
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if not self._fits(cost):
+                break
+            self._waiters.popleft()
+            self._take(cost)
+            future.set_result(None)
+
+
+class AdmissionMetrics:
+    """Contadores de admissão, expostos no formato texto do Prometheus"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.admitted_cost = 0
+        self.rejected: Dict[str, int] = {}
+        self.queued = 0
+        self.queue_wait_seconds = 0.0
+
+    def reject(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def render(self, controller: "AdmissionController") -> str:
+        budget = controller.budget
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        metric("analyze_admitted_total", "counter", "Analyze requests admitted",
+               [("", self.admitted)])
+        metric("analyze_admitted_cost_tokens_total", "counter", "Estimated tokens of admitted requests",
+               [("", self.admitted_cost)])
+        metric("analyze_rejected_total", "counter", "Analyze requests rejected by reason",
+               [(f'{{reason="{reason}"}}', count) for reason, count in sorted(self.rejected.items())])
+        metric("analyze_queued_total", "counter", "Analyze requests that waited for budget",
+               [("", self.queued)])
+        metric("analyze_queue_wait_seconds_total", "counter", "Time spent waiting for budget",
+               [("", round(self.queue_wait_seconds, 6))])
+        metric("analyze_inflight_requests", "gauge", "Analyses in progress",
+               [("", budget.requests)])
+        metric("analyze_inflight_cost_tokens", "gauge", "Estimated tokens of analyses in progress",
+               [("", budget.cost)])
+        metric("analyze_queue_length", "gauge", "Analyze requests waiting for budget",
+               [("", budget.waiting)])
+        metric("analyze_tracked_clients", "gauge", "Clients with a rate limit bucket",
+               [("", len(controller.limiter))])
+        metric("analyze_limit", "gauge", "Configured admission limits", [
+            ('{limit="max_inflight_requests"}', budget.max_requests),
+            ('{limit="max_inflight_cost_tokens"}', budget.max_cost),
+            ('{limit="max_queue_size"}', budget.max_waiters),
+            ('{limit="client_tokens_per_second"}', controller.limiter.rate),
+            ('{limit="client_burst_tokens"}', controller.limiter.capacity),
+        ])
+        return "\n".join(lines) + "\n"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Decide se uma análise entra agora, espera na fila ou é recusada.
+
+    O custo estimado (tokens das conversas mais um overhead por conversa) é
+    cobrado do balde do cliente e reservado no orçamento global até a
+    análise terminar. Os limites valem por processo (worker).
+    """
+
+    def __init__(self):
+        self.limiter = ClientRateLimiter(
+            settings.admission_client_tokens_per_second,
+            settings.admission_client_burst_tokens,
+            settings.admission_max_tracked_clients
+        )
+        self.budget = ConcurrencyBudget(
+            settings.admission_max_inflight_requests,
+            settings.admission_max_inflight_tokens,
+            settings.admission_max_queue_size
+        )
+        self.metrics = AdmissionMetrics()
+
+    @staticmethod
+    def estimate_cost(payload) -> int:
+        """Custo estimado em tokens de um corpo de /themes/analyze"""
+        conversations = payload.get("conversations") if isinstance(payload, dict) else None
+        if not isinstance(conversations, list):
+            return 0
+        return sum(
+            estimate_tokens(conversation) + settings.admission_conversation_overhead_tokens
+            for conversation in conversations
+            if isinstance(conversation, str)
+        )
+
+    async def admit(self, client: str, cost: int) -> int:
+        """Admite a análise e retorna o custo reservado (a liberar com ``release``)"""
+        bucket = self.limiter.bucket(client)
+        if cost > bucket.capacity:
+            self.metrics.reject("too_large")
+            raise AdmissionRejected(
+                413,
+                f"Pedido estimado em {cost} tokens excede o limite de {int(bucket.capacity)} por cliente; "
+                "divida as conversas em pedidos menores"
+            )
+
+        wait = bucket.try_consume(cost)
+        if wait > 0:
+            self.metrics.reject("rate_limited")
+            raise AdmissionRejected(429, "Limite de uso do cliente excedido", retry_after=wait)
+
+        reserved = self.budget.clamp(cost)
+        started = time.monotonic()
+        queued = self.budget.would_queue(reserved)
+        admitted = await self.budget.acquire(reserved, settings.admission_queue_timeout_seconds)
+        if queued:
+            self.metrics.queued += 1
+            self.metrics.queue_wait_seconds += time.monotonic() - started
+        if not admitted:
+            # O cliente não consumiu nada: devolver o custo ao balde dele
+            bucket.refund(cost)
+            self.metrics.reject("overloaded")
+            raise AdmissionRejected(
+                429,
+                "Servidor ocupado com outras análises, tente novamente",
+                retry_after=settings.admission_retry_after_seconds
+            )
+
+        self.metrics.admitted += 1
+        self.metrics.admitted_cost += cost
+        return reserved
+
+    def release(self, reserved: int):
+        self.budget.release(reserved)
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI que aplica o controle de admissão em POST /themes/analyze.
+
+    O corpo é lido aqui para estimar o custo e depois repassado intacto à
+    rota. Corpos que não são JSON válido seguem adiante para a validação
+    normal do FastAPI.
+    """
+
+    def __init__(self, app, controller: AdmissionController, path: str):
+        self.app = app
+        self.controller = controller
+        self.path = path
+        # Só os hashes das chaves conhecidas ficam em memória
+        self.api_key_hashes = {
+            hashlib.sha256(key.encode("utf-8")).hexdigest() for key in settings.admission_api_keys
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].rstrip("/") != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) > settings.admission_max_body_bytes:
+                self.controller.metrics.reject("body_too_large")
+                await self._reject(send, AdmissionRejected(413, "Corpo da requisição muito grande"))
+                return
+
+        try:
+            cost = self.controller.estimate_cost(json.loads(body))
+        except ValueError:
+            cost = 0
+
+        client = self._client_key(scope)
+        try:
+            reserved = await self.controller.admit(client, cost)
+        except AdmissionRejected as e:
+            logger.warning(f"Análise recusada ({e.status_code}) para o cliente {client[:12]}: {e.detail}")
+            await self._reject(send, e)
+            return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            self.controller.release(reserved)
+
+    def _client_key(self, scope) -> str:
+        """Identifica o cliente pela API key, se for uma das configuradas, ou pelo IP.
+
+        Uma chave qualquer no header não pode abrir um balde novo: bastaria
+        trocar de chave a cada requisição para escapar do limite.
+        """
+        header = settings.admission_api_key_header.lower().encode("latin-1")
+        for name, value in scope.get("headers", []):
+            if name == header and value:
+                digest = hashlib.sha256(value).hexdigest()
+                if digest in self.api_key_hashes:
+                    # A chave em si não fica em memória nem nos logs
+                    return "key:" + digest[:16]
+                break
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    @staticmethod
+    async def _reject(send, error: AdmissionRejected):
+        body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ]
+        if error.retry_after is not None:
+            headers.append((b"retry-after", str(max(1, math.ceil(error.retry_after))).encode("latin-1")))
+        await send({"type": "http.response.start", "status": error.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+admission_controller = AdmissionController()
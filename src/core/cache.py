@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+from src.core.config import settings
+from loguru import logger
+
+
+@dataclass
+class CacheEntry:
+    etag: str
+    body: bytes
+
+
+class CatalogCache:
+    """Cache de respostas serializadas do catálogo, versionado por escrita.
+
+    Fica em um SQLite local (WAL), compartilhado por todos os workers da
+    máquina. Cada tenant tem sua própria versão: uma escrita no catálogo do
+    tenant incrementa a versão dele, e entradas de versões anteriores deixam
+    de ser servidas. Falhas no cache nunca derrubam a requisição: elas apenas
+    fazem a leitura cair no banco.
+
+    Os métodos fazem I/O bloqueante no SQLite (com busy timeout): código
+    assíncrono deve chamá-los via ``asyncio.to_thread``.
+    """
+
+    def __init__(self, path: str, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, version INTEGER NOT NULL, etag TEXT NOT NULL, body BLOB NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def version(self, tenant_id: str) -> Optional[int]:
+        """Versão atual do catálogo do tenant (None se o cache estiver indisponível).
+
+        Tenant sem linha em ``versions`` está na versão 0: a leitura nunca escreve.
+        """
+        if not self.enabled:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT version FROM versions WHERE name = ?", (tenant_id,)
+            ).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.warning(f"Cache do catálogo indisponível: {e}")
+            return None
+
+    def lookup(self, tenant_id: str, key: str) -> Tuple[Optional[CacheEntry], Optional[int]]:
+        """Resposta em cache da versão atual, ou a versão para gerar uma nova"""
+        entry = self.get(tenant_id, key)
+        if entry is not None:
+            return entry, None
+        # Versão lida antes da consulta: uma escrita no meio invalida o resultado
+        return None, self.version(tenant_id)
+
+    def bump_version(self, tenant_id: str) -> None:
+        """Invalida as respostas em cache do tenant após uma escrita no catálogo"""
+        if not self.enabled:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO versions (name, version) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+                (tenant_id,)
+            )
+            # Faixa de chaves do tenant, resolvida pelo índice da chave primária
+            prefix = self._key(tenant_id, "")
+            conn.execute(
+                "DELETE FROM entries WHERE key >= ? AND key < ?",
+                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao invalidar cache do catálogo: {e}")
+
+    def get(self, tenant_id: str, key: str) -> Optional[CacheEntry]:
+        """Retorna a resposta em cache, se for da versão atual do catálogo do tenant"""
+        if not self.enabled:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT etag, body FROM entries "
+                "WHERE key = ? AND version = COALESCE((SELECT version FROM versions WHERE name = ?), 0)",
+                (self._key(tenant_id, key), tenant_id)
+            ).fetchone()
+            return CacheEntry(etag=row[0], body=row[1]) if row else None
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao ler cache do catálogo: {e}")
+            return None
+
+    def set(self, tenant_id: str, key: str, version: Optional[int], body: bytes) -> CacheEntry:
+        """Guarda a resposta gerada a partir da versão ``version`` do catálogo"""
+        etag = f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+        entry = CacheEntry(etag=etag, body=body)
+        if version is None:
+            return entry
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (key, version, etag, body) VALUES (?, ?, ?, ?)",
+                (self._key(tenant_id, key), version, etag, body)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao gravar cache do catálogo: {e}")
+        return entry
+
+    @staticmethod
+    def _key(tenant_id: str, key: str) -> str:
+        return f"{tenant_id}:{key}"
+
+
+catalog_cache = CatalogCache(settings.cache_path, enabled=settings.cache_enabled)
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -22,7 +22,67 @@ class Settings(BaseSettings):
     # Theme Analysis
     similarity_threshold: float = 0.85
     relevance_increment: float = 1.0
-    max_themes_per_analysis: int = 10
+    max_themes_per_analysis: int = 10  # per LLM call, i.e. per pipeline chunk
+    theme_lock_bucket_bits: int = 4
+    
+    # Multi-tenancy
+    default_tenant: str = "default"
+    tenants: List[str] = []
+    
+    # LLM Router
+    llm_timeout_seconds: float = 60.0
+    llm_max_retries: int = 2
+    llm_backoff_base_seconds: float = 0.5
+    llm_backoff_max_seconds: float = 8.0
+    llm_max_concurrency_per_provider: int = 8
+    llm_max_connections_per_provider: int = 20
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentile: float = 0.95
+    llm_hedge_initial_delay_seconds: float = 20.0
+    llm_hedge_min_samples: int = 20
+    llm_stats_window: int = 200
+    llm_error_half_life_seconds: float = 60.0
+    llm_explore_ratio: float = 0.05
+    
+    # Conversation Preprocessing
+    preprocess_enabled: bool = True
+    preprocess_near_duplicate_threshold: float = 0.8
+    preprocess_max_tokens_per_conversation: int = 2000
+    preprocess_minhash_permutations: int = 128
+    preprocess_lsh_bands: int = 32
+    preprocess_shingle_size: int = 3
+    preprocess_boilerplate_patterns: List[str] = []  # regexes matched against whole lines
+    
+    # Processing Pipeline
+    pipeline_chunk_size: int = 20
+    pipeline_extract_concurrency: int = 2
+    pipeline_embed_concurrency: int = 1
+    pipeline_embed_batch_size: int = 16
+    pipeline_db_concurrency: int = 1
+    pipeline_queue_size: int = 32
+    
+    # Admission Control (/themes/analyze), por worker
+    admission_enabled: bool = True
+    admission_api_key_header: str = "X-API-Key"
+    admission_api_keys: List[str] = []  # keys with their own bucket; anything else is limited per IP
+    admission_client_tokens_per_second: float = 2000.0
+    admission_client_burst_tokens: int = 200000
+    admission_max_inflight_requests: int = 8
+    admission_max_inflight_tokens: int = 400000
+    admission_max_queue_size: int = 32
+    admission_queue_timeout_seconds: float = 10.0
+    admission_retry_after_seconds: float = 5.0
+    admission_conversation_overhead_tokens: int = 50
+    admission_max_body_bytes: int = 10_000_000
+    admission_max_tracked_clients: int = 10000
+    
+    # Catalog Cache
+    cache_enabled: bool = True
+    cache_path: str = "cache/catalog_cache.sqlite3"
+    theme_list_max_limit: int = 1000  # upper bound for GET /themes/?limit=, keeps cache keys bounded
+    
+    # Export
+    export_batch_size: int = 1000
     
     # API
     api_prefix: str = "/api/v1"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Enum as SQLAEnum
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Index, Enum as SQLAEnum
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
@@ -20,14 +20,26 @@ class ThemeCategoryEnum(str, enum.Enum):
     OTHER = "outro"
 
 
+def tenant_partition_name(tenant_id: str) -> str:
+    """Nome da partição de themes de um tenant (tenant_id já validado)"""
+    return f"themes_t_{tenant_id}"
+
+
 class Theme(Base):
     __tablename__ = "themes"
+    __table_args__ = (
+        # Em tabela particionada, índices únicos precisam incluir a chave de partição
+        Index("ix_themes_semantic_key", "tenant_id", "semantic_key", unique=True),
+        {"postgresql_partition_by": "LIST (tenant_id)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    tenant_id = Column(String(64), primary_key=True)
     tema_geral = Column(String(255), nullable=False)
     subtema = Column(String(255), nullable=False)
     categoria = Column(SQLAEnum(ThemeCategoryEnum), nullable=False)
     palavras_chave = Column(Text, nullable=False)  # JSON string
+    semantic_key = Column(String(512))  # tema_geral|subtema normalizados
     relevancia = Column(Float, default=1.0)
     occurrence_count = Column(Integer, default=1)
     embedding = Column(Vector(384))  # Dimensão para sentence-transformers/all-MiniLM-L6-v2
@@ -17,6 +17,18 @@ class ThemeCategory(str, Enum):
     OTHER = "outro"
 
 
+# tenant_id também nomeia a partição do tenant e seus índices no banco:
+# "ix_themes_t_<tenant>_embedding_hnsw" precisa caber nos 63 caracteres de
+# identificador do Postgres, senão o nome é truncado e colide entre tenants
+TENANT_ID_PATTERN = r"^[a-z0-9_]{1,36}$"
+
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
+
+
 class ThemeBase(BaseModel):
     tema_geral: str = Field(..., description="Tema geral identificado")
     subtema: str = Field(..., description="Subtema específico")
@@ -28,6 +40,10 @@ class ThemeCreate(ThemeBase):
     pass
 
 
+class ExtractedTheme(ThemeBase):
+    ocorrencias: int = Field(default=1, ge=1, description="1 mais as cópias agrupadas das conversas em que o tema aparece")
+
+
 class ThemeInDB(ThemeBase):
     id: int
     relevancia: float = Field(default=1.0, description="Score de relevância do tema")
@@ -51,10 +67,13 @@ class ThemeResponse(ThemeBase):
 class ConversationAnalysisRequest(BaseModel):
     conversations: List[str] = Field(..., description="Lista de conversas para análise")
     period_hours: int = Field(default=24, description="Período de análise em horas")
+    tenant_id: Optional[str] = Field(default=None, pattern=TENANT_ID_PATTERN, description="Tenant dono do catálogo de temas")
 
 
 class ConversationAnalysisResponse(BaseModel):
     themes_identified: List[ThemeResponse]
     new_themes_count: int
     existing_themes_updated: int
-    analysis_timestamp: datetime
\ No newline at end of file
+    analysis_timestamp: datetime
+    duplicates_removed: int = Field(default=0, description="Conversas agrupadas como quase duplicadas antes do LLM")
+    tokens_saved: int = Field(default=0, description="Tokens estimados economizados pelo pré-processamento")
\ No newline at end of file
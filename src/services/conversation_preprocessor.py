@@ -0,0 +1,158 @@
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+import numpy as np
+from src.core.config import settings
+from src.utils.text import estimate_tokens, normalize_whitespace, truncate_to_tokens
+from loguru import logger
+
+
+# Primo maior que 2^32 para o hashing universal das permutações do MinHash
+_MERSENNE_PRIME = np.uint64(4294967311)
+
+
+@dataclass
+class PreparedConversation:
+    text: str
+    multiplicity: int = 1
+
+
+@dataclass
+class PreprocessingReport:
+    original_count: int
+    unique_count: int
+    original_tokens: int
+    prepared_tokens: int
+
+    @property
+    def duplicates_removed(self) -> int:
+        return self.original_count - self.unique_count
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.prepared_tokens)
+
+
+class ConversationPreprocessor:
+    """Reduz o texto enviado ao LLM sem perder o volume das conversas.
+
+    Normaliza espaços, remove linhas de boilerplate configuradas (saudações e
+    assinaturas de template), agrupa conversas quase idênticas (MinHash + LSH) mantendo a
+    multiplicidade de cada grupo e corta cada conversa ao orçamento de tokens.
+    """
+
+    def __init__(self):
+        self.threshold = settings.preprocess_near_duplicate_threshold
+        self.max_tokens = settings.preprocess_max_tokens_per_conversation
+        self.num_perm = settings.preprocess_minhash_permutations
+        self.bands = settings.preprocess_lsh_bands
+        self.shingle_size = settings.preprocess_shingle_size
+        self.boilerplate_patterns = [
+            re.compile(pattern, re.IGNORECASE) for pattern in settings.preprocess_boilerplate_patterns
+        ]
+
+        rng = np.random.default_rng(1)
+        self._perm_a = rng.integers(1, 2 ** 31, size=self.num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, 2 ** 31, size=self.num_perm, dtype=np.uint64)
+
+    def prepare(self, conversations: List[str]) -> Tuple[List[PreparedConversation], PreprocessingReport]:
+        """Prepara o batch de conversas para o prompt"""
+        original_tokens = sum(estimate_tokens(conversation) for conversation in conversations)
+
+        texts = [normalize_whitespace(conversation) for conversation in conversations]
+        texts = self._strip_boilerplate(texts)
+
+        prepared = []
+        for members in self._near_duplicate_groups(texts):
+            text = truncate_to_tokens(texts[members[0]], self.max_tokens)
+            prepared.append(PreparedConversation(text=text, multiplicity=len(members)))
+
+        report = PreprocessingReport(
+            original_count=len(conversations),
+            unique_count=len(prepared),
+            original_tokens=original_tokens,
+            prepared_tokens=sum(estimate_tokens(item.text) for item in prepared)
+        )
+        logger.info(
+            f"Pré-processamento: {report.original_count} conversas → {report.unique_count} únicas, "
+            f"~{report.tokens_saved} tokens economizados"
+        )
+        return prepared, report
+
+    def _strip_boilerplate(self, texts: List[str]) -> List[str]:
+        """Remove as linhas que casam inteiras com um padrão de boilerplate.
+
+        A frequência de uma linha no batch não basta para decidir: a mesma
+        reclamação repetida por muitos clientes é justamente o tema a extrair.
+        """
+        if not self.boilerplate_patterns:
+            return texts
+
+        stripped = []
+        for text in texts:
+            kept = "\n".join(
+                line for line in text.splitlines()
+                if not any(pattern.fullmatch(line) for pattern in self.boilerplate_patterns)
+            )
+            # Conversa só de boilerplate fica como está; o agrupamento a colapsa
+            stripped.append(kept or text)
+        return stripped
+
+    def _signature(self, text: str) -> np.ndarray:
+        # Números variam em mensagens de template (pedidos, datas, protocolos)
+        tokens = re.sub(r"\d+", "0", text.casefold()).split()
+        if len(tokens) >= self.shingle_size:
+            shingles = {" ".join(tokens[i:i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)}
+        else:
+            shingles = {" ".join(tokens)}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        permuted = (np.outer(self._perm_a, hashes) + self._perm_b[:, np.newaxis]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+    def _near_duplicate_groups(self, texts: List[str]) -> List[List[int]]:
+        """Agrupa conversas com similaridade de Jaccard estimada acima do limiar.
+
+        Retorna os grupos na ordem da primeira conversa de cada um.
+        """
+        if len(texts) < 2:
+            return [[index] for index in range(len(texts))]
+
+        signatures = np.stack([self._signature(text) for text in texts])
+        rows_per_band = max(1, self.num_perm // self.bands)
+        parent = list(range(len(texts)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for start in range(0, self.num_perm, rows_per_band):
+            buckets: Dict[bytes, List[int]] = {}
+            for index, band in enumerate(signatures[:, start:start + rows_per_band]):
+                buckets.setdefault(band.tobytes(), []).append(index)
+
+            for candidates in buckets.values():
+                if len(candidates) < 2:
+                    continue
+                # Cada membro é comparado só com o primeiro do bucket, o que mantém
+                # a banda linear mesmo com centenas de cópias de um template
+                anchor, others = candidates[0], candidates[1:]
+                # Confirmar os candidatos do LSH com a estimativa completa
+                similarity = np.mean(signatures[others] == signatures[anchor], axis=1)
+                for other, score in zip(others, similarity):
+                    if score < self.threshold:
+                        continue
+                    root_anchor, root_other = find(anchor), find(other)
+                    if root_anchor != root_other:
+                        parent[max(root_anchor, root_other)] = min(root_anchor, root_other)
+
+        groups: Dict[int, List[int]] = {}
+        for index in range(len(texts)):
+            groups.setdefault(find(index), []).append(index)
+        return sorted(groups.values(), key=lambda members: members[0])
@@ -1,6 +1,11 @@
+import asyncio
+import time
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
+from src.core.config import settings
+from src.core.database import AsyncSessionLocal
+from src.services.conversation_preprocessor import ConversationPreprocessor, PreparedConversation
 from src.services.theme_analyzer import ThemeAnalyzer
 from src.services.embeddings import EmbeddingService
 from src.services.theme_repository import ThemeRepository
@@ -9,62 +14,198 @@ from loguru import logger
 import json
 
 
+# Sinaliza aos workers de um estágio que não há mais itens
+_DONE = object()
+
+
 class ConversationProcessor:
     def __init__(self):
         self.theme_analyzer = ThemeAnalyzer()
         self.embedding_service = EmbeddingService()
+        self.preprocessor = ConversationPreprocessor()
     
     async def process_conversations(
-        self, 
-        conversations: List[str], 
-        db: AsyncSession
+        self,
+        conversations: List[str],
+        db: AsyncSession,
+        tenant_id: Optional[str] = None
     ) -> ConversationAnalysisResponse:
-        """Processa um batch de conversas e retorna análise de temas"""
+        """Processa um batch de conversas e retorna análise de temas.
         
-        logger.info(f"Processando {len(conversations)} conversas")
+        Os estágios extração (LLM) → embedding → busca/escrita no banco rodam
+        em paralelo, ligados por filas limitadas: o embedding do chunk k
+        sobrepõe a extração do chunk k+1 e a escrita no banco sobrepõe o
+        embedding. Cada estágio tem seu próprio limite de concorrência e as
+        filas cheias seguram o estágio anterior (backpressure).
         
-        # 1. Analisar conversas e extrair temas
-        extracted_themes = await self.theme_analyzer.analyze_conversations(conversations)
-        logger.info(f"{len(extracted_themes)} temas extraídos")
+        Cada chunk de ``pipeline_chunk_size`` conversas é uma chamada ao LLM:
+        ``max_themes_per_analysis`` limita os temas por chunk. Cada tema soma
+        relevância uma vez por chunk, mais uma por cópia de conversa agrupada
+        no pré-processamento em que apareceu.
+        """
         
-        # 2. Gerar embeddings para os temas
-        embeddings = self.embedding_service.encode_themes(extracted_themes)
+        tenant_id = tenant_id or settings.default_tenant
+        logger.info(f"Processando {len(conversations)} conversas (tenant {tenant_id})")
+        start = time.monotonic()
         
-        # 3. Processar cada tema
-        theme_repository = ThemeRepository(db)
-        processed_themes = []
-        new_themes_count = 0
-        existing_themes_updated = 0
+        # Agrupar duplicatas e compactar o texto antes de pagar tokens de LLM
+        report = None
+        if settings.preprocess_enabled:
+            prepared, report = await asyncio.to_thread(self.preprocessor.prepare, conversations)
+        else:
+            prepared = [PreparedConversation(text=conversation) for conversation in conversations]
+        
+        chunk_size = max(1, settings.pipeline_chunk_size)
+        chunk_queue: asyncio.Queue = asyncio.Queue()
+        for index in range(0, len(prepared), chunk_size):
+            chunk_queue.put_nowait((index // chunk_size, prepared[index:index + chunk_size]))
+        
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.pipeline_queue_size)
+        db_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.pipeline_queue_size)
+        results = []
+        
+        extract_workers = [
+            asyncio.create_task(self._extract_worker(chunk_queue, embed_queue, start))
+            for _ in range(max(1, settings.pipeline_extract_concurrency))
+        ]
+        embed_workers = [
+            asyncio.create_task(self._embed_worker(embed_queue, db_queue))
+            for _ in range(max(1, settings.pipeline_embed_concurrency))
+        ]
+        # O primeiro worker usa a sessão da requisição; os demais abrem sessões próprias
+        db_workers = [
+            asyncio.create_task(self._db_worker(db_queue, db if index == 0 else None, tenant_id, results))
+            for index in range(max(1, settings.pipeline_db_concurrency))
+        ]
+        
+        await self._run_pipeline([
+            self._close_stage(extract_workers, embed_queue, len(embed_workers)),
+            self._close_stage(embed_workers, db_queue, len(db_workers)),
+        ], extract_workers + embed_workers + db_workers)
+        
+        processed_themes, new_themes_count = self._aggregate_results(results)
+        existing_themes_updated = len(processed_themes) - new_themes_count
         
-        for theme, embedding in zip(extracted_themes, embeddings):
-            # Buscar tema similar no banco
-            similar_result = await theme_repository.find_similar_theme(theme, embedding)
-            
-            if similar_result:
-                # Tema similar encontrado - atualizar relevância
-                existing_theme, similarity = similar_result
-                logger.info(f"Tema similar encontrado (similaridade: {similarity:.2f}): {existing_theme.tema_geral}")
-                
-                updated_theme = await theme_repository.update_theme_relevance(existing_theme.id)
-                processed_themes.append(self._theme_to_response(updated_theme))
-                existing_themes_updated += 1
-            else:
-                # Novo tema - criar no banco
-                new_theme = await theme_repository.create_theme(theme, embedding)
-                processed_themes.append(self._theme_to_response(new_theme))
-                new_themes_count += 1
-        
-        # 4. Preparar resposta
         response = ConversationAnalysisResponse(
             themes_identified=processed_themes,
             new_themes_count=new_themes_count,
             existing_themes_updated=existing_themes_updated,
-            analysis_timestamp=datetime.utcnow()
+            analysis_timestamp=datetime.utcnow(),
+            duplicates_removed=report.duplicates_removed if report else 0,
+            tokens_saved=report.tokens_saved if report else 0
         )
         
-        logger.info(f"Análise concluída: {new_themes_count} novos temas, {existing_themes_updated} atualizados")
+        logger.info(
+            f"Análise concluída em {time.monotonic() - start:.2f}s: "
+            f"{new_themes_count} novos temas, {existing_themes_updated} atualizados"
+        )
         return response
     
+    def _aggregate_results(self, results: List) -> Tuple[List[ThemeResponse], int]:
+        """Consolida os temas da requisição inteira, na ordem da primeira extração.
+        
+        Chunks diferentes podem resolver para o mesmo tema do catálogo: ele
+        aparece uma vez na resposta, com o estado da última escrita, e conta
+        como novo se algum chunk o criou.
+        """
+        results.sort(key=lambda item: item[0])
+        themes: Dict[int, ThemeResponse] = {}
+        created = set()
+        for _, response, is_new in results:
+            current = themes.get(response.id)
+            if current is None or response.occurrence_count >= current.occurrence_count:
+                themes[response.id] = response
+            if is_new:
+                created.add(response.id)
+        return list(themes.values()), len(created)
+    
+    async def _run_pipeline(self, closers: List, workers: List[asyncio.Task]):
+        """Aguarda todos os estágios; a primeira falha cancela o pipeline inteiro"""
+        tasks = [asyncio.create_task(closer) for closer in closers] + workers
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    
+    async def _close_stage(self, workers: List[asyncio.Task], next_queue: asyncio.Queue, consumers: int):
+        """Quando os workers de um estágio terminam, encerra os do estágio seguinte"""
+        await asyncio.gather(*workers)
+        for _ in range(consumers):
+            await next_queue.put(_DONE)
+    
+    async def _extract_worker(self, chunk_queue: asyncio.Queue, embed_queue: asyncio.Queue, start: float):
+        """Estágio 1: extrai temas de cada chunk de conversas via LLM (streaming)"""
+        while True:
+            try:
+                chunk_index, chunk = chunk_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            
+            position = 0
+            texts = [item.text for item in chunk]
+            multiplicities = [item.multiplicity for item in chunk]
+            async for theme in self.theme_analyzer.stream_themes(texts, multiplicities):
+                if chunk_index == 0 and position == 0:
+                    logger.info(f"Primeiro tema recebido em {time.monotonic() - start:.2f}s")
+                await embed_queue.put(((chunk_index, position), theme))
+                position += 1
+            
+            logger.info(f"Chunk {chunk_index}: {position} temas extraídos")
+    
+    async def _embed_worker(self, embed_queue: asyncio.Queue, db_queue: asyncio.Queue):
+        """Estágio 2: gera embeddings em micro-batches com os temas já disponíveis"""
+        while True:
+            item = await embed_queue.get()
+            if item is _DONE:
+                return
+            
+            batch = [item]
+            finished = False
+            while len(batch) < settings.pipeline_embed_batch_size:
+                try:
+                    item = embed_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            
+            # Modelo de embeddings roda fora do event loop
+            themes = [theme for _, theme in batch]
+            embeddings = await asyncio.to_thread(self.embedding_service.encode_themes, themes)
+            
+            for (order, theme), embedding in zip(batch, embeddings):
+                await db_queue.put((order, theme, embedding))
+            
+            if finished:
+                return
+    
+    async def _db_worker(self, db_queue: asyncio.Queue, db: AsyncSession, tenant_id: str, results: List):
+        """Estágio 3: busca tema similar e cria ou atualiza no banco"""
+        if db is None:
+            async with AsyncSessionLocal() as session:
+                await self._db_worker(db_queue, session, tenant_id, results)
+            return
+        
+        theme_repository = ThemeRepository(db, tenant_id)
+        while True:
+            item = await db_queue.get()
+            if item is _DONE:
+                return
+            
+            order, theme, embedding = item
+            
+            # Buscar tema similar ou criar novo, seguro contra requisições concorrentes
+            resolved_theme, is_new = await theme_repository.resolve_theme(theme, embedding, theme.ocorrencias)
+            results.append((order, self._theme_to_response(resolved_theme), is_new))
+    
     def _theme_to_response(self, theme_db: any) -> ThemeResponse:
         """Converte tema do banco para schema de resposta"""
         # Parsear palavras-chave do JSON
@@ -80,4 +221,4 @@ class ConversationProcessor:
             occurrence_count=theme_db.occurrence_count,
             created_at=theme_db.created_at,
             updated_at=theme_db.updated_at
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,413 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, List, Optional
+import httpx
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+from src.core.config import settings
+from loguru import logger
+
+
+CompletionFn = Callable[[str], Awaitable[str]]
+StreamFn = Callable[[str], AsyncIterator[str]]
+
+
+class ProviderStats:
+    """Estatísticas de latência e erros de um provedor de LLM"""
+
+    def __init__(self, window: int = None):
+        window = window or settings.llm_stats_window
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.first_chunk_latencies: Deque[float] = deque(maxlen=window)
+        # Resultado das últimas chamadas (True = sucesso), para a taxa de erro recente
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.successes = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error_at: Optional[float] = None
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.successes += 1
+        self.consecutive_errors = 0
+
+    def record_abandoned(self, elapsed: float, first_chunk: bool = False):
+        """Registra uma chamada interrompida (perdedora de hedge) pelo tempo já gasto.
+
+        O tempo é um limite inferior da latência real: sem ele, um provedor
+        lento que sempre perde o hedge nunca seria medido e continuaria em
+        primeiro no ranking.
+        """
+        self.latencies.append(elapsed)
+        if first_chunk:
+            self.first_chunk_latencies.append(elapsed)
+
+    def record_first_chunk(self, latency: float):
+        self.first_chunk_latencies.append(latency)
+
+    def record_error(self):
+        self.errors += 1
+        self.outcomes.append(False)
+        self.consecutive_errors += 1
+        self.last_error_at = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        """Taxa de erro na janela recente (uma queda antiga não pesa para sempre)"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, p: float, first_chunk: bool = False) -> Optional[float]:
+        """Retorna o percentil p (0-1) das latências observadas"""
+        samples = self.first_chunk_latencies if first_chunk else self.latencies
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
+
+    def error_penalty(self) -> float:
+        """Penalidade das falhas consecutivas, que decai pela meia-vida configurada.
+
+        Sem o decaimento, uma queda curta rebaixaria o provedor para sempre:
+        ele só voltaria a receber tráfego via fallback ou hedging.
+        """
+        if not self.consecutive_errors or self.last_error_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.last_error_at
+        decay = 0.5 ** (elapsed / settings.llm_error_half_life_seconds)
+        return self.consecutive_errors * settings.llm_timeout_seconds * decay
+
+    def score(self) -> float:
+        """Custo estimado de usar o provedor (menor é melhor).
+
+        Sem amostras de latência o custo é só a penalidade de erros: um
+        provedor ainda não medido recebe a próxima chamada e passa a ser
+        medido, e um que só falha volta a ser tentado quando a penalidade decai.
+        """
+        median = self.percentile(0.5) or 0.0
+        return median * (1 + self.error_rate) + self.error_penalty()
+
+    def snapshot(self) -> dict:
+        return {
+            "successes": self.successes,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "error_rate": round(self.error_rate, 4),
+            "error_penalty": round(self.error_penalty(), 4),
+            "p50_latency": self.percentile(0.5),
+            "p95_latency": self.percentile(0.95),
+            "p50_first_chunk_latency": self.percentile(0.5, first_chunk=True),
+        }
+
+
+class LLMProvider:
+    """Provedor de LLM com limite de concorrência e estatísticas próprias"""
+
+    def __init__(
+        self,
+        name: str,
+        complete: CompletionFn,
+        stream: Optional[StreamFn] = None,
+        max_concurrency: int = None
+    ):
+        self.name = name
+        self.complete = complete
+        self.stream = stream
+        self.semaphore = asyncio.Semaphore(max_concurrency or settings.llm_max_concurrency_per_provider)
+        self.stats = ProviderStats()
+
+
+class LLMRouter:
+    """Roteia prompts entre provedores com timeout, retries e hedging"""
+
+    def __init__(self, providers: List[LLMProvider]):
+        self.providers = providers
+
+    def ranked_providers(self) -> List[LLMProvider]:
+        """Provedores ordenados pelo custo observado (ordem de cadastro desempata).
+
+        Uma fração ``llm_explore_ratio`` das chamadas vai para outro provedor
+        que não o melhor, para que as estatísticas dos demais não envelheçam.
+        """
+        indexed = list(enumerate(self.providers))
+        indexed.sort(key=lambda item: (item[1].stats.score(), item[0]))
+        ranked = [provider for _, provider in indexed]
+        if len(ranked) > 1 and random.random() < settings.llm_explore_ratio:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Transmite a resposta do melhor provedor trecho a trecho.
+
+        Retries, hedging e fallback valem até o primeiro trecho chegar; depois
+        disso a resposta fica presa ao provedor vencedor.
+        """
+        opened = await self._race(
+            lambda provider: self._open_stream_with_retries(provider, prompt),
+            discard=lambda stream: stream.aclose(),
+            first_chunk=True
+        )
+        try:
+            async for chunk in opened:
+                yield chunk
+        finally:
+            await opened.aclose()
+
+    async def _race(self, call, discard=None, first_chunk: bool = False):
+        """Executa ``call`` nos provedores em ordem, com hedging e fallback"""
+        providers = self.ranked_providers()
+        if not providers:
+            raise ValueError("Nenhuma API key configurada (OpenAI ou Anthropic)")
+
+        pending = set()
+        errors = []
+        remaining = list(providers)
+        winner = None
+
+        pending.add(asyncio.create_task(call(remaining.pop(0))))
+        try:
+            while pending and winner is None:
+                timeout = None
+                if settings.llm_hedge_enabled and remaining and len(pending) == 1:
+                    timeout = self._hedge_delay(providers[0], first_chunk)
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    # Primeiro provedor passou do percentil de latência: disparar hedge
+                    hedge = remaining.pop(0)
+                    logger.info(f"Hedge disparado para o provedor {hedge.name}")
+                    pending.add(asyncio.create_task(call(hedge)))
+                    continue
+
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        await discard(task.result())
+
+                # Todos os concorrentes falharam: fallback para o próximo provedor
+                if winner is None and not pending and remaining:
+                    pending.add(asyncio.create_task(call(remaining.pop(0))))
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+        if winner is None:
+            raise errors[-1]
+        return winner.result()
+
+    def _hedge_delay(self, provider: LLMProvider, first_chunk: bool = False) -> float:
+        samples = provider.stats.first_chunk_latencies if first_chunk else provider.stats.latencies
+        if len(samples) < settings.llm_hedge_min_samples:
+            return settings.llm_hedge_initial_delay_seconds
+        return provider.stats.percentile(settings.llm_hedge_percentile, first_chunk=first_chunk)
+
+    async def _open_stream_with_retries(self, provider: LLMProvider, prompt: str) -> "_ProviderStream":
+        """Abre o stream do provedor e aguarda o primeiro trecho, com retries"""
+        attempt = 0
+        while True:
+            await provider.semaphore.acquire()
+            stream = _ProviderStream(provider, prompt)
+            try:
+                await stream.open()
+                return stream
+            except asyncio.CancelledError:
+                # Perdedor do hedge: o tempo até aqui é um limite inferior da latência
+                provider.stats.record_abandoned(stream.elapsed(), first_chunk=True)
+                await stream.aclose()
+                raise
+            except Exception as e:
+                provider.stats.record_error()
+                await stream.aclose()
+                logger.warning(f"Erro no provedor {provider.name} (tentativa {attempt + 1}): {e!r}")
+                if attempt >= settings.llm_max_retries:
+                    raise
+
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _backoff(self, attempt: int) -> float:
+        """Backoff exponencial com full jitter"""
+        cap = min(settings.llm_backoff_max_seconds, settings.llm_backoff_base_seconds * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def stats(self) -> dict:
+        return {provider.name: provider.stats.snapshot() for provider in self.providers}
+
+    def render_metrics(self) -> str:
+        """Estatísticas dos provedores no formato texto do Prometheus"""
+        stats = self.stats()
+        lines: List[str] = []
+        gauges = [
+            ("llm_provider_successes_total", "counter", "successes", "LLM calls that succeeded"),
+            ("llm_provider_errors_total", "counter", "errors", "LLM calls that failed"),
+            ("llm_provider_consecutive_errors", "gauge", "consecutive_errors", "Failures since the last success"),
+            ("llm_provider_error_penalty_seconds", "gauge", "error_penalty", "Decaying routing penalty"),
+            ("llm_provider_latency_p50_seconds", "gauge", "p50_latency", "Median completion latency"),
+            ("llm_provider_latency_p95_seconds", "gauge", "p95_latency", "p95 completion latency"),
+            ("llm_provider_first_chunk_p50_seconds", "gauge", "p50_first_chunk_latency", "Median first chunk latency"),
+        ]
+        for name, kind, field, help_text in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for provider, snapshot in stats.items():
+                if snapshot[field] is not None:
+                    lines.append(f'{name}{{provider="{provider}"}} {snapshot[field]}')
+        return "\n".join(lines) + "\n"
+
+
+class _ProviderStream:
+    """Stream aberto em um provedor; mantém o slot de concorrência até fechar"""
+
+    def __init__(self, provider: LLMProvider, prompt: str):
+        self.provider = provider
+        self.prompt = prompt
+        self._iterator = None
+        self._first_chunk: Optional[str] = None
+        self._start = time.monotonic()
+        self._closed = False
+        self._finished = False
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    async def open(self):
+        if self.provider.stream is None:
+            # Provedor sem streaming: a resposta completa vira um único trecho
+            self._first_chunk = await asyncio.wait_for(
+                self.provider.complete(self.prompt),
+                timeout=settings.llm_timeout_seconds
+            )
+            self._iterator = None
+        else:
+            self._iterator = self.provider.stream(self.prompt).__aiter__()
+            self._first_chunk = await asyncio.wait_for(
+                self._iterator.__anext__(),
+                timeout=settings.llm_timeout_seconds
+            )
+        self.provider.stats.record_first_chunk(time.monotonic() - self._start)
+
+    async def __aiter__(self):
+        yield self._first_chunk
+        if self._iterator is not None:
+            while True:
+                try:
+                    # Timeout por trecho: um stream parado não segura a requisição
+                    chunk = await asyncio.wait_for(
+                        self._iterator.__anext__(),
+                        timeout=settings.llm_timeout_seconds
+                    )
+                except StopAsyncIteration:
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.provider.stats.record_error()
+                    raise
+                yield chunk
+        self._finished = True
+        self.provider.stats.record_success(self.elapsed())
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._first_chunk is not None and not self._finished:
+            # Stream aberto e descartado (hedge perdido) ou abandonado no meio
+            self.provider.stats.record_abandoned(self.elapsed())
+        try:
+            if self._iterator is not None and hasattr(self._iterator, "aclose"):
+                await self._iterator.aclose()
+        finally:
+            self.provider.semaphore.release()
+
+
+def _http_client() -> httpx.AsyncClient:
+    """Pool de conexões HTTP compartilhado por todas as chamadas de um provedor"""
+    limits = httpx.Limits(
+        max_connections=settings.llm_max_connections_per_provider,
+        max_keepalive_connections=settings.llm_max_connections_per_provider,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=settings.llm_timeout_seconds)
+
+
+def anthropic_provider(api_key: str) -> LLMProvider:
+    """Cria o provedor Anthropic (Claude)"""
+    # Retries ficam a cargo do roteador
+    client = AsyncAnthropic(api_key=api_key, http_client=_http_client(), max_retries=0)
+
+    async def complete(prompt: str) -> str:
+        response = await client.messages.create(
+            model="claude-3-sonnet-20240229",
+            max_tokens=2000,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return response.content[0].text
+
+    async def stream(prompt: str) -> AsyncIterator[str]:
+        response = await client.messages.create(
+            model="claude-3-sonnet-20240229",
+            max_tokens=2000,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        async for event in response:
+            if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                yield event.delta.text
+
+    return LLMProvider("anthropic", complete, stream)
+
+
+def openai_provider(api_key: str) -> LLMProvider:
+    """Cria o provedor OpenAI"""
+    client = AsyncOpenAI(api_key=api_key, http_client=_http_client(), max_retries=0)
+
+    async def complete(prompt: str) -> str:
+        response = await client.chat.completions.create(
+            model="gpt-4-turbo-preview",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"}
+        )
+        return response.choices[0].message.content
+
+    async def stream(prompt: str) -> AsyncIterator[str]:
+        response = await client.chat.completions.create(
+            model="gpt-4-turbo-preview",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    return LLMProvider("openai", complete, stream)
+
+
+_router: Optional[LLMRouter] = None
+
+
+def get_llm_router() -> LLMRouter:
+    """Retorna o roteador do processo, compartilhando clientes e pools entre requisições"""
+    global _router
+    if _router is None:
+        providers = []
+        if settings.anthropic_api_key:
+            providers.append(anthropic_provider(settings.anthropic_api_key))
+        if settings.openai_api_key:
+            providers.append(openai_provider(settings.openai_api_key))
+        _router = LLMRouter(providers)
+    return _router
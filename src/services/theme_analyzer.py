@@ -1,45 +1,71 @@
-import json
-from typing import List, Dict, Any
-from openai import AsyncOpenAI
-from anthropic import AsyncAnthropic
+from typing import AsyncIterator, List, Dict, Any, Optional
 from src.core.config import settings
-from src.models.schemas import ThemeBase, ThemeCategory
+from src.services.llm_router import LLMRouter, get_llm_router
+from src.services.theme_parser import ThemeStreamParser
+from src.models.schemas import ExtractedTheme, ThemeBase, ThemeCategory
 from loguru import logger
 
 
 class ThemeAnalyzer:
-    def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
-        
-        if settings.openai_api_key:
-            self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
-        if settings.anthropic_api_key:
-            self.anthropic_client = AsyncAnthropic(api_key=settings.anthropic_api_key)
+    def __init__(self, router: Optional[LLMRouter] = None):
+        self.router = router or get_llm_router()
     
     async def analyze_conversations(self, conversations: List[str]) -> List[ThemeBase]:
         """Analisa conversas e extrai temas relevantes"""
+        return [theme async for theme in self.stream_themes(conversations)]
+    
+    async def stream_themes(
+        self,
+        conversations: List[str],
+        multiplicities: Optional[List[int]] = None
+    ) -> AsyncIterator[ExtractedTheme]:
+        """Extrai temas via streaming, emitindo cada tema assim que o LLM o fecha.
+        
+        ``multiplicities`` indica quantas vezes cada conversa apareceu no batch
+        original, quando duplicatas foram agrupadas no pré-processamento. O LLM
+        informa em quais conversas numeradas cada tema aparece; só as cópias
+        extras dessas conversas somam ``ocorrencias`` além da primeira, então
+        um batch sem duplicatas conta cada tema uma vez, como antes.
+        """
+        multiplicities = multiplicities or [1] * len(conversations)
         
-        # Combinar conversas em um texto único para análise
-        combined_text = "\n\n---\n\n".join(conversations)
+        # Combinar conversas em um texto único para análise, numeradas e com as repetidas marcadas
+        combined_text = "\n\n---\n\n".join(
+            f"[Conversa {number}]\n{conversation}" if count == 1
+            else f"[Conversa {number} - repetida {count} vezes]\n{conversation}"
+            for number, (conversation, count) in enumerate(zip(conversations, multiplicities), start=1)
+        )
         
         # Preparar prompt
-        prompt = self._prepare_prompt(combined_text)
+        prompt = self._prepare_prompt(combined_text, repeated=any(count > 1 for count in multiplicities))
         
-        # Usar o cliente disponível
-        if self.anthropic_client:
-            themes_data = await self._analyze_with_anthropic(prompt)
-        elif self.openai_client:
-            themes_data = await self._analyze_with_openai(prompt)
-        else:
-            raise ValueError("Nenhuma API key configurada (OpenAI ou Anthropic)")
+        parser = ThemeStreamParser()
+        received = []
+        
+        # Roteador escolhe o provedor, com retries, hedging e fallback
+        try:
+            async for chunk in self.router.stream(prompt):
+                received.append(chunk)
+                for theme_data in parser.feed(chunk):
+                    theme = self._to_theme(theme_data, multiplicities)
+                    if theme is not None:
+                        yield theme
+        except Exception as e:
+            logger.error(f"Erro ao analisar conversas com LLM: {e}")
+            raise
+        finally:
+            parser.close()
         
-        # Parsear e validar temas
-        themes = self._parse_themes(themes_data)
-        return themes
+        if not parser.saw_json:
+            logger.error(f"JSON recebido: {''.join(received)}")
+            raise ValueError("Erro ao parsear resposta da análise: nenhum JSON encontrado")
     
-    def _prepare_prompt(self, text: str) -> str:
+    def _prepare_prompt(self, text: str, repeated: bool = False) -> str:
         """Prepara o prompt para análise de temas"""
+        volume_note = ""
+        if repeated:
+            volume_note = "\nConversas marcadas com \"repetida N vezes\" ocorreram N vezes no período; considere esse volume ao escolher os temas mais relevantes."
+        
         return f"""Analise as seguintes conversas e identifique os temas relevantes discutidos.
 
 Para cada tema identificado, forneça:
@@ -47,6 +73,7 @@ Para cada tema identificado, forneça:
 2. subtema: Um aspecto específico do tema (bem detalhado)
 3. categoria: Uma das seguintes - profissional, social, informativo, emocional, técnico, educacional, entretenimento, saúde, financeiro, outro
 4. palavras_chave: Lista de 3-5 palavras-chave relacionadas
+5. conversas: Lista com os números das conversas em que o tema aparece
 
 Retorne APENAS um JSON válido com uma lista de objetos tema, sem texto adicional.
 
@@ -56,7 +83,8 @@ Exemplo de formato:
     "tema_geral": "Desenvolvimento de Software",
     "subtema": "Implementação de APIs REST com FastAPI",
     "categoria": "técnico",
-    "palavras_chave": ["API", "FastAPI", "REST", "backend", "Python"]
+    "palavras_chave": ["API", "FastAPI", "REST", "backend", "Python"],
+    "conversas": [1, 3]
   }}
 ]
 
@@ -64,59 +92,33 @@ Conversas para análise:
 
 {text}
 
-Identifique no máximo {settings.max_themes_per_analysis} temas mais relevantes."""
-    
-    async def _analyze_with_anthropic(self, prompt: str) -> str:
-        """Analisa usando Claude da Anthropic"""
-        try:
-            response = await self.anthropic_client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.content[0].text
-        except Exception as e:
-            logger.error(f"Erro ao analisar com Anthropic: {e}")
-            raise
+Identifique no máximo {settings.max_themes_per_analysis} temas mais relevantes.{volume_note}"""
     
-    async def _analyze_with_openai(self, prompt: str) -> str:
-        """Analisa usando OpenAI"""
+    def _to_theme(self, theme_data: Dict[str, Any], multiplicities: List[int]) -> Optional[ExtractedTheme]:
+        """Valida um objeto tema; temas inválidos são descartados sem derrubar o batch"""
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"}
+            # Normalizar categoria
+            categoria = str(theme_data.get("categoria", "outro")).lower()
+            if categoria not in [cat.value for cat in ThemeCategory]:
+                categoria = ThemeCategory.OTHER.value
+            
+            return ExtractedTheme(
+                tema_geral=theme_data["tema_geral"],
+                subtema=theme_data["subtema"],
+                categoria=ThemeCategory(categoria),
+                palavras_chave=theme_data["palavras_chave"],
+                ocorrencias=self._count_occurrences(theme_data.get("conversas"), multiplicities)
             )
-            return response.choices[0].message.content
         except Exception as e:
-            logger.error(f"Erro ao analisar com OpenAI: {e}")
-            raise
+            logger.warning(f"Tema inválido descartado: {e} ({theme_data})")
+            return None
     
-    def _parse_themes(self, themes_json: str) -> List[ThemeBase]:
-        """Parseia e valida os temas extraídos"""
-        try:
-            # Tentar parsear o JSON
-            themes_data = json.loads(themes_json)
-            
-            # Validar e criar objetos ThemeBase
-            themes = []
-            for theme_data in themes_data:
-                # Normalizar categoria
-                categoria = theme_data.get("categoria", "outro").lower()
-                if categoria not in [cat.value for cat in ThemeCategory]:
-                    categoria = ThemeCategory.OTHER.value
-                
-                theme = ThemeBase(
-                    tema_geral=theme_data["tema_geral"],
-                    subtema=theme_data["subtema"],
-                    categoria=ThemeCategory(categoria),
-                    palavras_chave=theme_data["palavras_chave"]
-                )
-                themes.append(theme)
-            
-            return themes
-            
-        except Exception as e:
-            logger.error(f"Erro ao parsear temas: {e}")
-            logger.error(f"JSON recebido: {themes_json}")
-            raise ValueError(f"Erro ao parsear resposta da análise: {e}")
\ No newline at end of file
+    def _count_occurrences(self, numbers: Any, multiplicities: List[int]) -> int:
+        """Uma ocorrência pelo tema mais as cópias agrupadas das conversas citadas pelo LLM"""
+        if not isinstance(numbers, list):
+            return 1
+        valid = {
+            number for number in numbers
+            if isinstance(number, int) and not isinstance(number, bool) and 1 <= number <= len(multiplicities)
+        }
+        return 1 + sum(multiplicities[number - 1] - 1 for number in valid)
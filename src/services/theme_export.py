@@ -0,0 +1,191 @@
+import base64
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, List
+import numpy as np
+from sqlalchemy import select
+from src.core.config import settings
+from src.core.database import AsyncSessionLocal
+from src.models.database import Theme
+from src.models.schemas import ExportFormat
+from loguru import logger
+
+
+EXPORT_COLUMNS = [
+    "id", "tema_geral", "subtema", "categoria", "palavras_chave",
+    "relevancia", "occurrence_count", "created_at", "updated_at"
+]
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv; charset=utf-8",
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+
+def parquet_available() -> bool:
+    """Indica se o pyarrow está instalado para exportar em Parquet"""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ThemeExporter:
+    """Exporta o catálogo em streaming, com memória constante.
+
+    As linhas vêm de um cursor server-side em lotes de ``batch_size`` e cada
+    lote é serializado e enviado antes do próximo ser lido.
+    """
+
+    def __init__(
+        self,
+        export_format: ExportFormat,
+        tenant_id: str,
+        include_embeddings: bool = False,
+        batch_size: int = None
+    ):
+        self.format = export_format
+        self.tenant_id = tenant_id
+        self.include_embeddings = include_embeddings
+        self.batch_size = batch_size or settings.export_batch_size
+        self.columns = EXPORT_COLUMNS + (["embedding"] if include_embeddings else [])
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """Gera o arquivo exportado em pedaços de bytes"""
+        writers = {
+            ExportFormat.CSV: self._stream_csv,
+            ExportFormat.NDJSON: self._stream_ndjson,
+            ExportFormat.PARQUET: self._stream_parquet,
+        }
+        try:
+            async for chunk in writers[self.format]():
+                yield chunk
+        except Exception as e:
+            # O status HTTP já foi enviado: só resta registrar e cortar o stream
+            logger.error(f"Erro ao exportar temas: {e}")
+            raise
+
+    async def _batches(self) -> AsyncIterator[List[Dict]]:
+        """Lê o catálogo por um cursor server-side, um lote por vez"""
+        columns = [getattr(Theme, name) for name in self.columns]
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(
+                select(*columns)
+                .where(Theme.tenant_id == self.tenant_id)
+                .order_by(Theme.id)
+                .execution_options(yield_per=self.batch_size)
+            )
+            async for rows in result.partitions(self.batch_size):
+                yield [self._normalize(row._mapping) for row in rows]
+
+    def _normalize(self, row) -> Dict:
+        record = dict(row)
+        categoria = record["categoria"]
+        record["categoria"] = categoria.value if hasattr(categoria, "value") else categoria
+        palavras_chave = record["palavras_chave"]
+        record["palavras_chave"] = json.loads(palavras_chave) if isinstance(palavras_chave, str) else palavras_chave
+        if self.include_embeddings:
+            embedding = record["embedding"]
+            record["embedding"] = None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+        return record
+
+    def _text_value(self, record: Dict, name: str):
+        value = record[name]
+        if name == "embedding" and value is not None:
+            # float32 little-endian em base64
+            return base64.b64encode(value).decode("ascii")
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return value
+
+    async def _stream_csv(self) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+        yield buffer.getvalue().encode("utf-8")
+
+        async for batch in self._batches():
+            buffer.seek(0)
+            buffer.truncate()
+            for record in batch:
+                values = [self._text_value(record, name) for name in self.columns]
+                values[self.columns.index("palavras_chave")] = json.dumps(record["palavras_chave"], ensure_ascii=False)
+                writer.writerow(values)
+            yield buffer.getvalue().encode("utf-8")
+
+    async def _stream_ndjson(self) -> AsyncIterator[bytes]:
+        async for batch in self._batches():
+            lines = [
+                json.dumps({name: self._text_value(record, name) for name in self.columns}, ensure_ascii=False)
+                for record in batch
+            ]
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    async def _stream_parquet(self) -> AsyncIterator[bytes]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fields = [
+            pa.field("id", pa.int64()),
+            pa.field("tema_geral", pa.string()),
+            pa.field("subtema", pa.string()),
+            pa.field("categoria", pa.string()),
+            pa.field("palavras_chave", pa.list_(pa.string())),
+            pa.field("relevancia", pa.float64()),
+            pa.field("occurrence_count", pa.int64()),
+            pa.field("created_at", pa.timestamp("us", tz="UTC")),
+            pa.field("updated_at", pa.timestamp("us", tz="UTC")),
+        ]
+        if self.include_embeddings:
+            fields.append(pa.field("embedding", pa.binary(settings.embedding_dimension * 4)))
+        schema = pa.schema(fields)
+
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+        try:
+            async for batch in self._batches():
+                columns = {name: [record[name] for record in batch] for name in self.columns}
+                # Cada lote vira um row group, enviado assim que é escrito
+                writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+
+class _ChunkSink:
+    """Destino de escrita que acumula bytes até serem drenados para a resposta.
+
+    Mantém a posição absoluta, que o writer Parquet usa nos offsets do rodapé.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
@@ -0,0 +1,83 @@
+import json
+from typing import Any, Dict, List
+from loguru import logger
+
+
+class ThemeStreamParser:
+    """Parser incremental de JSON que emite cada objeto tema assim que ele fecha.
+
+    Tolera texto livre antes e depois do JSON, cercas de código (```json) e
+    wrappers como ``{"temas": [...]}`` (modo json_object da OpenAI): qualquer
+    objeto que contenha ``tema_geral`` é considerado um tema, independente da
+    profundidade em que aparece.
+    """
+
+    THEME_KEY = "tema_geral"
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._object_starts: List[int] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.saw_json = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consome um trecho do texto e retorna os temas que fecharam nele"""
+        themes = []
+        for char in chunk:
+            if self._depth == 0:
+                # Fora de qualquer estrutura JSON: ignorar prosa e cercas
+                if char not in "{[":
+                    continue
+                self._buffer = []
+                self.saw_json = True
+
+            self._buffer.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "{":
+                    self._object_starts.append(len(self._buffer) - 1)
+            elif char in "}]":
+                self._depth = max(0, self._depth - 1)
+                if char == "}" and self._object_starts:
+                    start = self._object_starts.pop()
+                    theme = self._decode("".join(self._buffer[start:]))
+                    if theme is not None:
+                        themes.append(theme)
+                if self._depth == 0:
+                    self._buffer = []
+                    self._object_starts = []
+        return themes
+
+    def close(self) -> None:
+        """Finaliza o parse, descartando estruturas que nunca fecharam"""
+        if self._depth > 0:
+            logger.warning("Resposta do LLM terminou com JSON incompleto")
+        self._buffer = []
+        self._object_starts = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _decode(self, raw: str):
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            # Objetos externos que contêm um tema inválido também caem aqui
+            return None
+        if isinstance(data, dict) and self.THEME_KEY in data:
+            return data
+        return None
@@ -1,30 +1,203 @@
+import asyncio
 import json
+import zlib
 from typing import List, Optional, Tuple
-from sqlalchemy import select, text
+from sqlalchemy import delete, func, literal_column, select, text, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.models.database import Theme
 from src.models.schemas import ThemeBase, ThemeCreate
-from src.services.embeddings import EmbeddingService
+from src.utils.semantic import embedding_bucket, normalize_theme_key
+from src.core.cache import catalog_cache
 from src.core.config import settings
 from loguru import logger
 
 
+# Namespace dos advisory locks de resolução de temas (primeira chave do par)
+THEME_LOCK_NAMESPACE = zlib.crc32(b"themes") & 0x7FFFFFFF
+
+# Buscas repetidas quando o tema encontrado some antes do incremento;
+# esgotadas, a resolução segue para o upsert
+MAX_SIMILAR_LOOKUPS = 3
+
+
 class ThemeRepository:
-    def __init__(self, db_session: AsyncSession):
+    def __init__(self, db_session: AsyncSession, tenant_id: Optional[str] = None):
         self.db = db_session
-        self.embedding_service = EmbeddingService()
+        self.tenant_id = tenant_id or settings.default_tenant
     
-    async def find_similar_theme(self, theme: ThemeBase, embedding: List[float]) -> Optional[Tuple[Theme, float]]:
-        """Busca tema similar usando busca vetorial"""
+    async def resolve_theme(
+        self,
+        theme: ThemeBase,
+        embedding: List[float],
+        occurrences: int = 1
+    ) -> Tuple[Theme, bool]:
+        """Encontra o tema equivalente no catálogo ou cria um novo, sem duplicar sob concorrência.
+        
+        A resolução roda em uma transação que segura um advisory lock do bucket
+        LSH do embedding: requisições com temas parecidos se serializam, as
+        demais seguem em paralelo. A inserção usa ON CONFLICT na chave textual
+        normalizada e, como temas parecidos podem cair em buckets vizinhos,
+        um tema recém-criado ainda é reconciliado com os concorrentes.
+        
+        ``occurrences`` é 1 mais as cópias de conversas agrupadas no
+        pré-processamento em que o tema apareceu: relevância e contador
+        crescem por ocorrência.
+        
+        Retorna o tema e se ele foi criado nesta chamada.
+        """
         try:
-            # Query usando pgvector para busca por similaridade
+            await self.db.execute(
+                text("SELECT pg_advisory_xact_lock(:namespace, :bucket)"),
+                {"namespace": THEME_LOCK_NAMESPACE, "bucket": self._lock_key(embedding)}
+            )
+            
+            for _ in range(MAX_SIMILAR_LOOKUPS):
+                similar_result = await self.find_similar_theme(theme, embedding)
+                if not similar_result:
+                    break
+                existing_theme, similarity = similar_result
+                logger.info(f"Tema similar encontrado (similaridade: {similarity:.2f}): {existing_theme.tema_geral}")
+                resolved = await self._increment_relevance(
+                    existing_theme.id, settings.relevance_increment * occurrences, occurrences
+                )
+                if resolved is not None:
+                    await self.db.commit()
+                    await asyncio.to_thread(catalog_cache.bump_version, self.tenant_id)
+                    return resolved, False
+                # Tema fundido por uma reconciliação ou pela compactação desde a busca
+                logger.warning(f"Tema {existing_theme.id} removido durante a resolução, refazendo a busca")
+            
+            resolved, inserted = await self._upsert_theme(theme, embedding, occurrences)
+            await self.db.commit()
+            await asyncio.to_thread(catalog_cache.bump_version, self.tenant_id)
+        except Exception as e:
+            logger.error(f"Erro ao resolver tema: {e}")
+            await self.db.rollback()
+            raise
+        
+        if inserted:
+            logger.info(f"Novo tema criado: {resolved.tema_geral} - {resolved.subtema}")
+            return await self._reconcile_new_theme(resolved, theme, embedding)
+        return resolved, False
+    
+    async def _reconcile_new_theme(self, new_theme: Theme, theme: ThemeBase, embedding: List[float]) -> Tuple[Theme, bool]:
+        """Funde o tema recém-criado com um equivalente criado em paralelo.
+        
+        Roda depois do commit: de dois inserts concorrentes, o último a
+        verificar sempre enxerga o outro. O tema de maior id é apagado e seus
+        contadores somados ao de menor id; o DELETE ... RETURNING garante que
+        só uma das requisições aplique a fusão.
+        """
+        try:
+            similar_result = await self.find_similar_theme(theme, embedding, exclude_id=new_theme.id)
+            if not similar_result:
+                await self.db.commit()
+                return new_theme, True
+            
+            other_id = similar_result[0].id
+            keep_id, drop_id = min(other_id, new_theme.id), max(other_id, new_theme.id)
+            
+            dropped = (await self.db.execute(
+                delete(Theme)
+                .where(Theme.tenant_id == self.tenant_id, Theme.id == drop_id)
+                .returning(Theme.relevancia, Theme.occurrence_count)
+            )).first()
+            merged = None
+            if dropped is not None:
+                merged = await self._increment_relevance(keep_id, dropped.relevancia, dropped.occurrence_count)
+            
+            if merged is None:
+                # Fusão já aplicada por outra requisição (ou alvo fundido em outro tema)
+                await self.db.rollback()
+                candidates = [(new_theme.id, True)]
+                if drop_id == new_theme.id:
+                    candidates.insert(0, (keep_id, False))
+                for theme_id, is_new in candidates:
+                    current = await self.db.get(Theme, (theme_id, self.tenant_id), populate_existing=True)
+                    if current is not None:
+                        await self.db.commit()
+                        return current, is_new
+                raise ValueError(f"Tema com ID {new_theme.id} não encontrado")
+            
+            await self.db.commit()
+            await asyncio.to_thread(catalog_cache.bump_version, self.tenant_id)
+            logger.info(f"Tema {drop_id} criado em paralelo fundido no tema {keep_id}")
+            return merged, keep_id == new_theme.id
+        except Exception as e:
+            logger.error(f"Erro ao reconciliar tema: {e}")
+            await self.db.rollback()
+            raise
+    
+    def _lock_key(self, embedding: List[float]) -> int:
+        """Chave do advisory lock: bucket LSH do embedding dentro do tenant"""
+        key = f"{self.tenant_id}:{embedding_bucket(embedding)}".encode("utf-8")
+        return zlib.crc32(key) & 0x7FFFFFFF
+    
+    async def _upsert_theme(self, theme: ThemeBase, embedding: List[float], occurrences: int = 1) -> Tuple[Theme, bool]:
+        """Insere o tema ou, se a chave normalizada já existir, incrementa o existente"""
+        statement = (
+            insert(Theme)
+            .values(
+                tenant_id=self.tenant_id,
+                tema_geral=theme.tema_geral,
+                subtema=theme.subtema,
+                categoria=theme.categoria.value,
+                palavras_chave=json.dumps(theme.palavras_chave, ensure_ascii=False),
+                semantic_key=normalize_theme_key(theme.tema_geral, theme.subtema),
+                relevancia=1.0 + settings.relevance_increment * (occurrences - 1),
+                occurrence_count=occurrences,
+                embedding=embedding
+            )
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[Theme.tenant_id, Theme.semantic_key],
+            set_={
+                "relevancia": Theme.relevancia + settings.relevance_increment * occurrences,
+                "occurrence_count": Theme.occurrence_count + occurrences,
+                "updated_at": func.now()
+            }
+        ).returning(Theme, literal_column("(xmax = 0)").label("inserted"))
+        
+        result = await self.db.execute(statement, execution_options={"populate_existing": True})
+        row = result.one()
+        return row[0], bool(row.inserted)
+    
+    async def _increment_relevance(self, theme_id: int, increment: float, occurrences: int = 1) -> Optional[Theme]:
+        """Incrementa relevância e contador de forma atômica no banco"""
+        result = await self.db.execute(
+            update(Theme)
+            .where(Theme.tenant_id == self.tenant_id, Theme.id == theme_id)
+            .values(
+                relevancia=Theme.relevancia + increment,
+                occurrence_count=Theme.occurrence_count + occurrences
+            )
+            .returning(Theme),
+            execution_options={"populate_existing": True}
+        )
+        return result.scalar_one_or_none()
+    
+    async def find_similar_theme(
+        self,
+        theme: ThemeBase,
+        embedding: List[float],
+        exclude_id: Optional[int] = None
+    ) -> Optional[Tuple[Theme, float]]:
+        """Busca tema similar usando busca vetorial na partição do tenant"""
+        try:
+            # Query usando pgvector para busca por similaridade. Ordenar pela
+            # distância (e não filtrar por ela) permite usar o índice HNSW da
+            # partição do tenant; o limiar é aplicado sobre o vizinho mais
+            # próximo. Tenants da partição compartilhada, sem índice vetorial,
+            # caem em um scan exato.
             query = text("""
-                SELECT id, tema_geral, subtema, categoria, palavras_chave, relevancia, 
+                SELECT id, tenant_id, tema_geral, subtema, categoria, palavras_chave, relevancia, 
                        occurrence_count, created_at, updated_at,
-                       1 - (embedding <=> :embedding::vector) as similarity
+                       1 - (embedding <=> CAST(:embedding AS vector)) as similarity
                 FROM themes
-                WHERE 1 - (embedding <=> :embedding::vector) > :threshold
-                ORDER BY similarity DESC
+                WHERE tenant_id = :tenant_id
+                  AND (CAST(:exclude_id AS integer) IS NULL OR id <> :exclude_id)
+                ORDER BY embedding <=> CAST(:embedding AS vector)
                 LIMIT 1
             """)
             
@@ -32,15 +205,17 @@ class ThemeRepository:
                 query,
                 {
                     "embedding": embedding,
-                    "threshold": settings.similarity_threshold
+                    "tenant_id": self.tenant_id,
+                    "exclude_id": exclude_id
                 }
             )
             
             row = result.first()
-            if row:
+            if row and row.similarity > settings.similarity_threshold:
                 # Criar objeto Theme manualmente
                 theme_dict = {
                     "id": row.id,
+                    "tenant_id": row.tenant_id,
                     "tema_geral": row.tema_geral,
                     "subtema": row.subtema,
                     "categoria": row.categoria,
@@ -65,24 +240,14 @@ class ThemeRepository:
     async def create_theme(self, theme: ThemeBase, embedding: List[float]) -> Theme:
         """Cria um novo tema no banco de dados"""
         try:
-            # Converter palavras-chave para JSON string
-            palavras_chave_json = json.dumps(theme.palavras_chave, ensure_ascii=False)
-            
-            new_theme = Theme(
-                tema_geral=theme.tema_geral,
-                subtema=theme.subtema,
-                categoria=theme.categoria.value,
-                palavras_chave=palavras_chave_json,
-                relevancia=1.0,
-                occurrence_count=1,
-                embedding=embedding
-            )
-            
-            self.db.add(new_theme)
+            new_theme, inserted = await self._upsert_theme(theme, embedding)
             await self.db.commit()
-            await self.db.refresh(new_theme)
+            await asyncio.to_thread(catalog_cache.bump_version, self.tenant_id)
             
-            logger.info(f"Novo tema criado: {new_theme.tema_geral} - {new_theme.subtema}")
+            if inserted:
+                logger.info(f"Novo tema criado: {new_theme.tema_geral} - {new_theme.subtema}")
+            else:
+                logger.info(f"Tema já existente atualizado: {new_theme.tema_geral} - {new_theme.subtema}")
             return new_theme
             
         except Exception as e:
@@ -96,21 +261,15 @@ class ThemeRepository:
             if increment is None:
                 increment = settings.relevance_increment
             
-            # Buscar tema
-            result = await self.db.execute(
-                select(Theme).where(Theme.id == theme_id)
-            )
-            theme = result.scalar_one_or_none()
+            # Atualizar relevância e contador no próprio UPDATE, sem perder
+            # incrementos de requisições concorrentes
+            theme = await self._increment_relevance(theme_id, increment)
             
             if not theme:
                 raise ValueError(f"Tema com ID {theme_id} não encontrado")
             
-            # Atualizar relevância e contador
-            theme.relevancia += increment
-            theme.occurrence_count += 1
-            
             await self.db.commit()
-            await self.db.refresh(theme)
+            await asyncio.to_thread(catalog_cache.bump_version, self.tenant_id)
             
             logger.info(f"Relevância atualizada para tema {theme.id}: {theme.relevancia}")
             return theme
@@ -125,6 +284,7 @@ class ThemeRepository:
         try:
             result = await self.db.execute(
                 select(Theme)
+                .where(Theme.tenant_id == self.tenant_id)
                 .order_by(Theme.relevancia.desc())
                 .limit(limit)
             )
@@ -0,0 +1,44 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List
+import numpy as np
+from src.core.config import settings
+
+
+def normalize_theme_key(tema_geral: str, subtema: str) -> str:
+    """Chave textual normalizada do tema (minúsculas, sem acentos e pontuação)"""
+    parts = []
+    for value in (tema_geral, subtema):
+        value = unicodedata.normalize("NFKD", value or "")
+        value = "".join(char for char in value if not unicodedata.combining(char))
+        value = re.sub(r"[^\w\s]", " ", value.lower())
+        parts.append(" ".join(value.split()))
+    return "|".join(parts)[:512]
+
+
+@lru_cache(maxsize=8)
+def _hyperplanes(bits: int, dimension: int, seed: int) -> np.ndarray:
+    # Semente fixa: todos os processos precisam concordar sobre os buckets
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((bits, dimension)).astype(np.float32)
+
+
+def embedding_buckets(embeddings, bits: int, seed: int = 0) -> np.ndarray:
+    """Bucket LSH (hiperplanos aleatórios) de cada embedding.
+
+    Vetores próximos em similaridade de cosseno tendem a cair no mesmo
+    bucket; quanto menos bits, maior essa chance e menor o paralelismo.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    planes = _hyperplanes(bits, vectors.shape[1], seed)
+    signs = (vectors @ planes.T) > 0
+    weights = 1 << np.arange(bits, dtype=np.int64)
+    return signs.astype(np.int64) @ weights
+
+
+def embedding_bucket(embedding: List[float], bits: int = None) -> int:
+    """Bucket LSH de um único embedding"""
+    return int(embedding_buckets(embedding, bits or settings.theme_lock_bucket_bits)[0])
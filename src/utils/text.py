@@ -0,0 +1,28 @@
+import math
+import re
+
+
+# Aproximação usada pelos tokenizers BPE em texto misto pt/en
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata do número de tokens de um texto"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def normalize_whitespace(text: str) -> str:
+    """Remove espaços repetidos e linhas vazias, preservando as quebras de linha"""
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = " [...]") -> str:
+    """Corta o texto no último espaço antes do orçamento de tokens"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars - len(marker))
+    if cut <= 0:
+        cut = max_chars - len(marker)
+    return text[:cut].rstrip() + marker
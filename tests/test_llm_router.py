@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+from src.core.config import settings
+from src.services.llm_router import LLMProvider, LLMRouter, ProviderStats
+
+
+@pytest.fixture(autouse=True)
+def router_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_timeout_seconds", 5.0)
+    monkeypatch.setattr(settings, "llm_max_retries", 0)
+    monkeypatch.setattr(settings, "llm_backoff_base_seconds", 0.0)
+    monkeypatch.setattr(settings, "llm_hedge_enabled", False)
+    monkeypatch.setattr(settings, "llm_hedge_initial_delay_seconds", 0.05)
+    monkeypatch.setattr(settings, "llm_hedge_min_samples", 1000)
+    monkeypatch.setattr(settings, "llm_explore_ratio", 0.0)
+
+
+def fake_provider(name, delay=0.0, fail=False, chunks=None, calls=None, max_concurrency=1):
+    """Provedor falso com streaming; registra em ``calls`` cada chamada recebida"""
+
+    async def stream(prompt):
+        if calls is not None:
+            calls.append(name)
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(f"{name} indisponível")
+        for chunk in chunks or [name]:
+            yield chunk
+
+    async def complete(prompt):
+        raise AssertionError("o roteador deve usar o streaming")
+
+    return LLMProvider(name, complete, stream, max_concurrency=max_concurrency)
+
+
+async def collect(router, prompt="prompt"):
+    return "".join([chunk async for chunk in router.stream(prompt)])
+
+
+def released(*providers):
+    return all(provider.semaphore._value == 1 for provider in providers)
+
+
+@pytest.mark.asyncio
+async def test_fastest_provider_takes_the_traffic():
+    calls = []
+    slow = fake_provider("anthropic", delay=0.05, calls=calls)
+    fast = fake_provider("openai", delay=0.001, calls=calls)
+    router = LLMRouter([slow, fast])
+
+    results = [await collect(router) for _ in range(10)]
+
+    # Cada provedor é medido uma vez; depois o mais rápido recebe todo o tráfego
+    assert results.count("openai") >= 9
+    assert router.ranked_providers()[0] is fast
+    assert released(slow, fast)
+
+
+@pytest.mark.asyncio
+async def test_streams_all_chunks_from_winner():
+    provider = fake_provider("anthropic", chunks=['[{"tema_geral"', ': "x"}]'])
+    router = LLMRouter([provider])
+
+    assert await collect(router) == '[{"tema_geral": "x"}]'
+    assert provider.stats.successes == 1
+    assert provider.stats.first_chunk_latencies
+    assert released(provider)
+
+
+@pytest.mark.asyncio
+async def test_falls_back_when_provider_fails():
+    broken = fake_provider("anthropic", fail=True)
+    healthy = fake_provider("openai")
+    router = LLMRouter([broken, healthy])
+
+    assert await collect(router) == "openai"
+    assert broken.stats.errors == 1
+    assert broken.stats.consecutive_errors == 1
+    assert released(broken, healthy)
+
+
+@pytest.mark.asyncio
+async def test_retries_before_falling_back(monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_retries", 2)
+    attempts = []
+    flaky = fake_provider("anthropic", fail=True, calls=attempts)
+    router = LLMRouter([flaky])
+
+    with pytest.raises(RuntimeError):
+        await collect(router)
+
+    assert len(attempts) == 3
+    assert released(flaky)
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_and_slow_loser_is_measured(monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_enabled", True)
+    slow = fake_provider("anthropic", delay=1.0)
+    fast = fake_provider("openai", delay=0.001)
+    router = LLMRouter([slow, fast])
+
+    assert await collect(router) == "openai"
+    # O cancelamento do perdedor é processado na próxima volta do event loop
+    await asyncio.sleep(0.01)
+
+    # O perdedor cancelado registra o tempo já gasto como limite inferior
+    assert slow.stats.latencies
+    assert min(slow.stats.latencies) >= settings.llm_hedge_initial_delay_seconds
+    assert router.ranked_providers()[0] is fast
+    assert released(slow, fast)
+
+
+@pytest.mark.asyncio
+async def test_semaphore_released_when_consumer_stops_early():
+    provider = fake_provider("anthropic", chunks=["a", "b", "c"])
+    router = LLMRouter([provider])
+
+    stream = router.stream("prompt")
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+
+    assert released(provider)
+    assert provider.stats.successes == 0
+
+
+@pytest.mark.asyncio
+async def test_exploration_sends_traffic_to_other_providers(monkeypatch):
+    monkeypatch.setattr(settings, "llm_explore_ratio", 1.0)
+    best = fake_provider("anthropic")
+    other = fake_provider("openai")
+    best.stats.record_success(0.1)
+    other.stats.record_success(1.0)
+    router = LLMRouter([best, other])
+
+    assert router.ranked_providers()[0] is other
+
+
+def test_error_rate_uses_recent_window():
+    stats = ProviderStats(window=4)
+    for _ in range(4):
+        stats.record_error()
+    assert stats.error_rate == 1.0
+
+    for _ in range(4):
+        stats.record_success(0.1)
+    assert stats.error_rate == 0.0
+    assert stats.errors == 4
+
+
+def test_error_penalty_decays(monkeypatch):
+    monkeypatch.setattr(settings, "llm_error_half_life_seconds", 10.0)
+    stats = ProviderStats()
+    stats.record_error()
+    fresh = stats.error_penalty()
+
+    stats.last_error_at -= 10.0
+    assert stats.error_penalty() == pytest.approx(fresh / 2, rel=1e-3)
+
+
+def test_unmeasured_provider_outranks_measured():
+    measured = fake_provider("anthropic")
+    measured.stats.record_success(0.3)
+    unmeasured = fake_provider("openai")
+
+    assert LLMRouter([measured, unmeasured]).ranked_providers()[0] is unmeasured